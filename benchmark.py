@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import warnings
+from collections import deque
+
+from aiohttp import ClientSession, web
+
+# Benchmark Telegram'ga ulanmaydi: Bot API o'rniga mahalliy aiohttp server ishlatiladi.
+# bot.py import qilinganda JSON fayllar joriy papkada yaratiladi, shuning uchun
+# import vaqtinchalik papkada bajariladi.
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_mb():
+    # Linux'da ru_maxrss kilobaytlarda
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Bot API o'rnini bosuvchi server: sozlanadigan kechikish va 429 javoblar
+class FakeBotApi:
+    def __init__(self, latency: float, error_rate: float, retry_after: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = {}
+        self.throttled = 0
+        self._message_id = 0
+        self._runner = None
+
+    async def start(self, port: int) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}/bot"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _message(self, chat_id, **extra):
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1, "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and method != "getMe" and random.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        data = dict(await request.post()) if request.content_type != "application/json" else await request.json()
+        chat_id = data.get("chat_id", 1)
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getChatMember":
+            result = {"status": "member", "user": {"id": int(data.get("user_id", 1)), "is_bot": False, "first_name": "U"}}
+        elif method == "sendVideo":
+            video = str(data.get("video", "video"))
+            result = self._message(chat_id, video={
+                "file_id": f"fid-{abs(hash(video))}", "file_unique_id": f"u-{abs(hash(video))}",
+                "width": 1280, "height": 720, "duration": 1440,
+            })
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=str(data.get("text", "")))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": make_user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "video",
+            },
+        },
+    }
+
+
+def chat_member_update(update_id, user_id, channel_index):
+    user = make_user(user_id)
+    return {
+        "update_id": update_id,
+        "chat_member": {
+            "chat": {"id": -1000000000000 - channel_index, "type": "channel", "title": f"Kanal {channel_index}",
+                     "username": f"bench_channel_{channel_index}"},
+            "from": user,
+            "date": int(time.time()),
+            "old_chat_member": {"user": user, "status": "left"},
+            "new_chat_member": {"user": user, "status": "member"},
+        },
+    }
+
+
+def generate_catalog(bot, movies: int, parts_ratio: float, max_parts: int) -> list:
+    bot.movies_data.clear()
+    serials = []
+    for number in range(1, movies + 1):
+        key = str(number)
+        if random.random() < parts_ratio:
+            count = random.randint(1, max_parts)
+            bot.movies_data[key] = {
+                "title": f"Anime {number}",
+                "parts": count,
+                "part_data": [{"part_name": f"{i}-qism", "part_url": f"https://cdn.example/{number}/{i}.mp4"}
+                              for i in range(1, count + 1)],
+                "views": 0,
+            }
+            serials.append(key)
+        else:
+            bot.movies_data[key] = {"title": f"Anime {number}", "video_url": f"https://cdn.example/{number}.mp4", "views": 0}
+    return serials
+
+
+def generate_users(bot, users: int) -> None:
+    bot.user_registry.clear()
+    joined, offset = bot.UserRegistry.parse_date("2024-01-01 00:00:00+00:00")
+    for user_id in range(1, users + 1):
+        bot.user_registry.add(user_id, f"user{user_id}", f"User{user_id}", joined, offset=offset)
+
+
+class Runner:
+    def __init__(self, bot, application, api, webhook_url: str, concurrency: int):
+        self.bot = bot
+        self.application = application
+        self.api = api
+        self.webhook_url = webhook_url
+        self.concurrency = concurrency
+        self.update_id = 0
+        self._sent_at = {}
+        self._latencies = []
+        self._arrivals = {}
+        self._order_errors = 0
+        original = application.process_update
+        original_submit = bot.webhook_ingress.submit
+
+        # Navbatga kelish tartibi foydalanuvchi bo'yicha yoziladi: bitta foydalanuvchining
+        # yangilanishlari parallel ishlovda ham shu tartibda boshlanishi kerak
+        def tracked_submit(data):
+            accepted = original_submit(data)
+            if accepted:
+                key = bot.WebhookIngress.ordering_key(data)
+                self._arrivals.setdefault(key, deque()).append(data["update_id"])
+            return accepted
+
+        # Har bir yangilanish webhook'ga yuborilgandan to handler tugagunigacha o'lchanadi
+        async def timed_process_update(update):
+            arrivals = self._arrivals.get(update.effective_user.id if update.effective_user else None)
+            if arrivals and arrivals.popleft() != update.update_id:
+                self._order_errors += 1
+            try:
+                await original(update)
+            finally:
+                sent_at = self._sent_at.pop(update.update_id, None)
+                if sent_at is not None:
+                    self._latencies.append(time.perf_counter() - sent_at)
+
+        application.process_update = timed_process_update
+        bot.webhook_ingress.submit = tracked_submit
+
+    def next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    async def run(self, name: str, updates: list) -> dict:
+        self._latencies = []
+        self._order_errors = 0
+        chat_member_calls = self.api.calls.get("getChatMember", 0)
+        rejected = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        async with ClientSession() as session:
+            async def post(update):
+                nonlocal rejected
+                async with semaphore:
+                    self._sent_at[update["update_id"]] = time.perf_counter()
+                    async with session.post(self.webhook_url, json=update) as response:
+                        if response.status != 200:
+                            rejected += 1
+                            self._sent_at.pop(update["update_id"], None)
+            await asyncio.gather(*[post(update) for update in updates])
+        await self.bot.webhook_ingress.queue.join()
+        elapsed = time.perf_counter() - started
+        return {
+            "scenario": name,
+            "updates": len(updates),
+            "rejected": rejected,
+            "seconds": elapsed,
+            "rate": len(updates) / elapsed if elapsed else 0.0,
+            "p50": percentile(self._latencies, 0.50) * 1000,
+            "p99": percentile(self._latencies, 0.99) * 1000,
+            "order_errors": self._order_errors,
+            "get_chat_member": self.api.calls.get("getChatMember", 0) - chat_member_calls,
+        }
+
+
+def scenario_updates(runner: Runner, serials: list, args) -> dict:
+    movie_count = len(runner.bot.movies_data)
+    users = list(range(10_000_000, 10_000_000 + args.active_users))
+    scenarios = {}
+
+    scenarios["number_lookup"] = [
+        message_update(runner.next_id(), random.choice(users), str(random.randint(1, movie_count)))
+        for _ in range(args.updates)
+    ]
+
+    # Qism tanlash va navigatsiya: avval serial ochiladi, keyin tugmalar bosiladi
+    parts = []
+    for _ in range(args.updates // 3):
+        user_id = random.choice(users)
+        number = random.choice(serials)
+        count = len(runner.bot.movies_data[number]["part_data"])
+        parts.append(message_update(runner.next_id(), user_id, number))
+        parts.append(callback_update(runner.next_id(), user_id, runner.bot.callback_router.encode("p", number, random.randrange(count))))
+        parts.append(callback_update(runner.next_id(), user_id, runner.bot.callback_router.encode("n", number, 1)))
+    scenarios["parts_and_navigation"] = parts
+
+    # Kanallardan chat_member kelgan foydalanuvchilar obunasi getChatMember siz tekshiriladi
+    members = []
+    for i in range(args.updates // (args.channels + 1)):
+        user_id = 30_000_000 + i
+        members.extend(chat_member_update(runner.next_id(), user_id, channel) for channel in range(args.channels))
+        members.append(message_update(runner.next_id(), user_id, str(random.randint(1, movie_count))))
+    scenarios["indexed_lookup"] = members
+
+    first_new = 20_000_000
+    scenarios["start_new_users"] = [
+        message_update(runner.next_id(), first_new + i, "/start") for i in range(args.updates)
+    ]
+    return scenarios
+
+
+async def run_broadcast(bot, application, limit: int) -> dict:
+    targets = bot.user_registry.active_ids()[:limit]
+    started = time.perf_counter()
+    job = await bot.broadcast_manager.start(application.bot, "Benchmark xabari", 1, targets)
+    await asyncio.gather(*bot.broadcast_manager._tasks.values())
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": "broadcast",
+        "updates": len(targets),
+        "rejected": job.failed,
+        "seconds": elapsed,
+        "rate": len(targets) / elapsed if elapsed else 0.0,
+        "p50": 0.0,
+        "p99": 0.0,
+        "order_errors": 0,
+        "get_chat_member": 0,
+    }
+
+
+def print_report(results: list, api: FakeBotApi) -> None:
+    print()
+    print(f"{'scenario':<24}{'updates':>10}{'rejected':>10}{'sec':>9}{'upd/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'order':>8}{'getCM':>8}")
+    for r in results:
+        print(f"{r['scenario']:<24}{r['updates']:>10}{r['rejected']:>10}{r['seconds']:>9.2f}"
+              f"{r['rate']:>10.1f}{r['p50']:>10.1f}{r['p99']:>10.1f}{r['order_errors']:>8}{r['get_chat_member']:>8}")
+    print()
+    print("Bot API chaqiruvlari: " + ", ".join(f"{k}={v}" for k, v in sorted(api.calls.items())))
+    print(f"429 javoblar: {api.throttled}")
+    print(f"Eng yuqori RSS: {peak_rss_mb():.1f} MB")
+
+
+async def main(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("BROADCAST_RATE", str(args.broadcast_rate))
+    os.environ.setdefault("BROADCAST_CONCURRENCY", "50")
+    os.environ.setdefault("NOTIFICATION_CHANNEL_ID", "-1009999999999")
+    sys.path.insert(0, BOT_DIR)
+    if not args.verbose:
+        warnings.filterwarnings("ignore")
+    import bot
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+    bot.load_data()
+
+    random.seed(args.seed)
+    api = FakeBotApi(args.latency / 1000, args.error_rate, args.retry_after)
+    base_url = await api.start(args.api_port)
+
+    t0 = time.perf_counter()
+    serials = generate_catalog(bot, args.movies, args.parts_ratio, args.max_parts)
+    generate_users(bot, args.users)
+    bot.CHANNELS[:] = [f"@bench_channel_{i}" for i in range(args.channels)]
+    print(f"Ma'lumot yaratildi: {args.movies} anime, {args.users} foydalanuvchi "
+          f"({time.perf_counter() - t0:.1f} s), RSS {peak_rss_mb():.1f} MB")
+
+    application = bot.build_application(TOKEN, base_url=base_url)
+    bot.application = application
+    app = web.Application()
+    app.router.add_post("/", bot.webhook_handler)
+    web_runner = web.AppRunner(app)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, "127.0.0.1", args.webhook_port).start()
+
+    await application.initialize()
+    await application.start()
+    await bot.webhook_ingress.start(application)
+    await bot.replay_pending_updates()
+
+    runner = Runner(bot, application, api, f"http://127.0.0.1:{args.webhook_port}/", args.concurrency)
+    results = []
+    scenarios = scenario_updates(runner, serials, args)
+    for name in args.scenarios:
+        if name == "broadcast":
+            results.append(await run_broadcast(bot, application, args.broadcast_limit))
+        else:
+            results.append(await runner.run(name, scenarios[name]))
+        print(f"{name}: tayyor")
+
+    await bot.shutdown(web_runner, [], handover=False)
+    await api.stop()
+    print_report(results, api)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Botni soxta Bot API serveri bilan yuklama ostida sinash")
+    parser.add_argument("--movies", type=int, default=10_000, help="Katalogdagi animelar soni (10k-100k)")
+    parser.add_argument("--users", type=int, default=1_000_000, help="Ro'yxatdan o'tgan foydalanuvchilar soni")
+    parser.add_argument("--parts-ratio", type=float, default=0.1, help="Qismli animelar ulushi")
+    parser.add_argument("--max-parts", type=int, default=1000, help="Serialdagi eng ko'p qismlar soni")
+    parser.add_argument("--channels", type=int, default=5, help="Majburiy obuna kanallari soni")
+    parser.add_argument("--updates", type=int, default=1000, help="Har bir ssenariydagi yangilanishlar soni")
+    parser.add_argument("--active-users", type=int, default=5000, help="Ssenariylarda qatnashadigan foydalanuvchilar")
+    parser.add_argument("--concurrency", type=int, default=100, help="Bir vaqtda yuboriladigan webhook so'rovlari")
+    parser.add_argument("--latency", type=float, default=5, help="Soxta Bot API javob kechikishi, ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 javoblar ehtimoli (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 javobidagi retry_after, soniya")
+    parser.add_argument("--broadcast-limit", type=int, default=20_000, help="Broadcast qabul qiluvchilari soni")
+    parser.add_argument("--broadcast-rate", type=float, default=5000, help="Broadcast tezligi, xabar/soniya")
+    parser.add_argument("--scenarios", nargs="+",
+                        default=["number_lookup", "parts_and_navigation", "indexed_lookup", "start_new_users", "broadcast"],
+                        choices=["number_lookup", "parts_and_navigation", "indexed_lookup", "start_new_users", "broadcast"])
+    parser.add_argument("--api-port", type=int, default=18081)
+    parser.add_argument("--webhook-port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Bot loglarini ko'rsatish")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,112 @@
+import argparse
+import gc
+import json
+import marshal
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Foydalanuvchilar ro'yxatining ikki ko'rinishini solishtiradi: avvalgi users_data
+# (str -> dict) va active_users to'plami hamda bot.UserRegistry ustunlari.
+# bot.py import qilinganda JSON fayllar joriy papkada yaratiladi, shuning uchun
+# import vaqtinchalik papkada bajariladi.
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+FIRST_NAMES = ["Ali", "Vali", "Aziz", "Dilnoza", "Madina", "Jasur", "Sardor", "Nodira", "Bekzod", "Malika",
+               "Otabek", "Shahnoza", "Sherzod", "Gulnora", "Jamshid", "Kamola", "Noma'lum"]
+
+
+def generate_users(count: int) -> dict:
+    users = {}
+    for i in range(count):
+        user_id = 100_000_000 + i * 7
+        users[str(user_id)] = {
+            "username": f"user{user_id}" if i % 5 else "Noma'lum",
+            "first_name": random.choice(FIRST_NAMES),
+            "joined_date": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:00+00:00",
+            "active": i % 10 != 0,
+        }
+    return users
+
+
+# Avvalgi ko'rinish: har bir foydalanuvchi uchun dict, ID va sana satr ko'rinishida
+def build_dicts(text: str) -> tuple:
+    users = json.loads(text)
+    active = {user_id for user_id, user in users.items() if user.get("active", True)}
+    return users, active
+
+
+def build_registry(bot, text: str):
+    return bot.UserRegistry.from_json(json.loads(text))
+
+
+def measure_memory(build) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 2 ** 20, peak / 2 ** 20
+
+
+def timed(func, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def main(args) -> None:
+    os.chdir(tempfile.mkdtemp(prefix="bot-users-"))
+    sys.path.insert(0, BOT_DIR)
+    import bot
+
+    random.seed(args.seed)
+    text = json.dumps(generate_users(args.users), ensure_ascii=False)
+    print(f"users.json: {args.users} foydalanuvchi, {len(text) / 2 ** 20:.1f} MB")
+
+    (users, active), dict_mb, dict_peak = measure_memory(lambda: build_dicts(text))
+    registry, registry_mb, registry_peak = measure_memory(lambda: build_registry(bot, text))
+    columns = marshal.dumps(registry.columns())
+
+    known = list(users)
+    probes = [int(random.choice(known)) if i % 2 else random.randrange(10 ** 9) for i in range(args.lookups)]
+    probe_keys = [str(user_id) for user_id in probes]
+    rows = [
+        ("xotira, MB", f"{dict_mb:.1f}", f"{registry_mb:.1f}"),
+        ("yuklashdagi cho'qqi, MB", f"{dict_peak:.1f}", f"{registry_peak:.1f}"),
+        ("JSON dan yuklash, s", f"{timed(lambda: build_dicts(text)):.2f}",
+         f"{timed(lambda: build_registry(bot, text)):.2f}"),
+        ("ikkilik nusxadan yuklash, s", "-",
+         f"{timed(lambda: bot.UserRegistry.from_columns(marshal.loads(columns))):.2f}"),
+        (f"{args.lookups} ta tekshiruv (start), ms",
+         f"{timed(lambda: [key in users for key in probe_keys], 3) * 1000:.1f}",
+         f"{timed(lambda: [user_id in registry for user_id in probes], 3) * 1000:.1f}"),
+        ("faollar ro'yxati (broadcast), ms", f"{timed(lambda: list(active), 3) * 1000:.1f}",
+         f"{timed(registry.active_ids, 3) * 1000:.1f}"),
+        ("son (send_user_count), us", f"{timed(lambda: (len(users), len(active)), 1000) * 1e6:.2f}",
+         f"{timed(lambda: (len(registry), registry.active_count), 1000) * 1e6:.2f}"),
+    ]
+    assert len(active) == registry.active_count and len(users) == len(registry)
+
+    print()
+    print(f"{'':<34}{'dict':>12}{'UserRegistry':>14}")
+    for name, old, new in rows:
+        print(f"{name:<34}{old:>12}{new:>14}")
+    print()
+    print(f"Ikkilik nusxa bo'limi: {len(columns) / 2 ** 20:.1f} MB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Foydalanuvchilar ro'yxatining xotira va tezlik sinovi")
+    parser.add_argument("--users", type=int, default=1_000_000, help="Foydalanuvchilar soni")
+    parser.add_argument("--lookups", type=int, default=100_000, help="A'zolik tekshiruvlari soni")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
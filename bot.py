@@ -3,7 +3,7 @@ import json
 import asyncio
 import nest_asyncio
 import os
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -12,11 +12,43 @@ from telegram.ext import (
     filters,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
+    ChatMemberHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    BasePersistence,
+    PersistenceInput,
 )
 from telegram.constants import ChatMemberStatus
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 from aiohttp import web
+import aiohttp
 import uuid
+import time
+import signal
+import sqlite3
+import threading
+import hmac
+import functools
+import inspect
+import bisect
+import subprocess
+import sys
+import mmap
+import marshal
+import hashlib
+import re
+import socket
+import random
+import gc
+import zlib
+import secrets
+from collections import OrderedDict, deque
+from array import array
+from itertools import compress
+from datetime import datetime, timedelta, timezone
 
 # .env faylidan ma'lumotlarni yuklash
 load_dotenv()
@@ -30,6 +62,110 @@ ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")) if os.getenv("A
 NOTIFICATION_CHANNEL_ID = os.getenv("NOTIFICATION_CHANNEL_ID")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 PORT = int(os.getenv("PORT", 10000))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# Webhook navbati: so'rov darhol tasdiqlanadi, yangilanishlar fonda qayta ishlanadi.
+# WEBHOOK_WORKERS - bir vaqtda ishlanadigan yangilanishlar chegarasi; bitta foydalanuvchining
+# yangilanishlari baribir ketma-ket ishlanadi, shuning uchun suhbatlar tartibi buzilmaydi.
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 16))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000))
+
+# Ma'lumotlar ombori: "json" (movies.json, users.json, channels.json) yoki "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.db")
+
+# Ko'p jarayonli rejim: nazoratchi jarayon PORT ni tinglaydi va yangilanishlarni
+# foydalanuvchi ID si bo'yicha doim bitta ishchiga uzatadi, shuning uchun suhbat holati
+# va user_data shu ishchi xotirasida qoladi. Ishchilar faqat 127.0.0.1 da
+# WORKER_BASE_PORT + raqam portini tinglaydi va bitta SQLite bazani bo'lishadi.
+# 0-jarayon asosiy: webhook o'rnatadi va fon ishlarini bajaradi.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", 0))
+IS_PRIMARY = WORKER_INDEX == 0
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", PORT + 1))
+ROUTER_BATCH_SIZE = int(os.getenv("ROUTER_BATCH_SIZE", 100))
+# Nazoratchi har ishga tushganda yangi kalit yaratib, ishchilarga muhit orqali beradi
+ROUTER_SECRET = os.getenv("BOT_ROUTER_SECRET")
+ROUTER_SECRET_HEADER = "X-Bot-Router-Secret"
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", 1))
+
+# Broadcast sozlamalari: Bot API taxminan 30 xabar/soniya ruxsat beradi
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))
+BROADCAST_STATE_FILE = "broadcasts.json"
+
+# file_id isitish: katalogdagi videolarni shu chatga yuborib, file_id larni oldindan oladi
+FILE_ID_WARMUP_CHAT_ID = os.getenv("FILE_ID_WARMUP_CHAT_ID")
+FILE_ID_WARMUP_RATE = float(os.getenv("FILE_ID_WARMUP_RATE", 1))
+
+# Yangi foydalanuvchilar haqida NOTIFICATION_CHANNEL_ID ga yig'ma xabar yuboriladi: har
+# JOIN_DIGEST_INTERVAL soniyada yoki JOIN_DIGEST_MAX_EVENTS ta qo'shilishdan keyin.
+# Xabarda umumiy son va birinchi JOIN_DIGEST_PROFILES ta profil bo'ladi.
+JOIN_DIGEST_INTERVAL = float(os.getenv("JOIN_DIGEST_INTERVAL", 60))
+JOIN_DIGEST_MAX_EVENTS = int(os.getenv("JOIN_DIGEST_MAX_EVENTS", 500))
+JOIN_DIGEST_PROFILES = int(os.getenv("JOIN_DIGEST_PROFILES", 20))
+
+# Obuna keshi sozlamalari (soniyalarda)
+SUB_CACHE_TTL = float(os.getenv("SUB_CACHE_TTL", 300))
+SUB_CACHE_NEGATIVE_TTL = float(os.getenv("SUB_CACHE_NEGATIVE_TTL", 30))
+SUB_CACHE_MAX_SIZE = int(os.getenv("SUB_CACHE_MAX_SIZE", 100000))
+SUB_CHECK_TIMEOUT = float(os.getenv("SUB_CHECK_TIMEOUT", 5))
+
+# Kanal a'zoligi indeksi: chat_member yangilanishlari bilan to'ldiriladi va har
+# MEMBERSHIP_FLUSH_INTERVAL soniyada saqlanadi. Har MEMBERSHIP_RECONCILE_INTERVAL soniyada
+# har bir kanaldan MEMBERSHIP_RECONCILE_SAMPLE ta tasodifiy yozuv getChatMember bilan solishtiriladi.
+# JSON omborida o'zgarishlar MEMBERSHIP_LOG ga qo'shiladi, har MEMBERSHIP_COMPACT_RECORDS
+# yozuvdan keyin to'liq indeks MEMBERSHIP_FILE ga yozilib jurnal bo'shatiladi.
+MEMBERSHIP_FILE = "membership.json"
+MEMBERSHIP_LOG = "membership.log"
+MEMBERSHIP_COMPACT_RECORDS = int(os.getenv("MEMBERSHIP_COMPACT_RECORDS", 360))
+MEMBERSHIP_FLUSH_INTERVAL = float(os.getenv("MEMBERSHIP_FLUSH_INTERVAL", 10))
+MEMBERSHIP_RECONCILE_INTERVAL = float(os.getenv("MEMBERSHIP_RECONCILE_INTERVAL", 3600))
+MEMBERSHIP_RECONCILE_SAMPLE = int(os.getenv("MEMBERSHIP_RECONCILE_SAMPLE", 50))
+
+# Ko'rishlar hisoblagichi: har VIEWS_FLUSH_INTERVAL soniyada yoki
+# VIEWS_FLUSH_THRESHOLD ta ko'rishdan keyin diskka yoziladi
+VIEWS_FLUSH_INTERVAL = float(os.getenv("VIEWS_FLUSH_INTERVAL", 30))
+VIEWS_FLUSH_THRESHOLD = int(os.getenv("VIEWS_FLUSH_THRESHOLD", 500))
+FILE_ID_FLUSH_INTERVAL = float(os.getenv("FILE_ID_FLUSH_INTERVAL", 30))
+FILE_ID_FLUSH_THRESHOLD = int(os.getenv("FILE_ID_FLUSH_THRESHOLD", 200))
+
+# Flooddan himoya: har bir foydalanuvchi uchun soniyasiga RATE ta, BURST gacha to'planadigan
+# xabar va callback limiti. FLOOD_MAX_USERS dan ortiq bucket eng eskisidan boshlab o'chiriladi.
+FLOOD_MESSAGE_RATE = float(os.getenv("FLOOD_MESSAGE_RATE", 1))
+FLOOD_MESSAGE_BURST = float(os.getenv("FLOOD_MESSAGE_BURST", 5))
+FLOOD_CALLBACK_RATE = float(os.getenv("FLOOD_CALLBACK_RATE", 2))
+FLOOD_CALLBACK_BURST = float(os.getenv("FLOOD_CALLBACK_BURST", 10))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", 200000))
+
+# context.user_data va suhbat holatlari: har USER_STATE_FLUSH_INTERVAL soniyada o'zgarganlari
+# yoziladi, USER_STATE_TTL soniya davomida tegilmagan yozuvlar xotiradan va ombordan o'chiriladi
+USER_STATE_FLUSH_INTERVAL = float(os.getenv("USER_STATE_FLUSH_INTERVAL", 10))
+USER_STATE_TTL = float(os.getenv("USER_STATE_TTL", 7 * 24 * 3600))
+# JSON omborida o'zgarishlar USER_STATE_LOG ga qo'shib boriladi; USER_STATE_COMPACT_RECORDS
+# ta yozuvdan keyin yoki tozalashda to'liq holat USER_STATE_FILE ga yozilib, jurnal bo'shatiladi
+USER_STATE_FILE = "user_state.json"
+USER_STATE_LOG = "user_state.log"
+USER_STATE_COMPACT_RECORDS = int(os.getenv("USER_STATE_COMPACT_RECORDS", 1000))
+
+# To'xtatish: ishlanayotgan yangilanishlar shuncha soniya kutiladi. RESTART_HANDOVER=1 bo'lsa
+# restart paytida yangi jarayon portni egallagandan keyingina eskisi to'xtaydi (HANDOVER_TIMEOUT gacha).
+# Ishlanmay qolgan yangilanishlar HANDOVER_FILE ga yoziladi va keyingi jarayon ularni qayta ishlaydi.
+# Yangi jarayon start_new_session bilan alohida sessiyada ishga tushadi: systemd, docker kabi
+# jarayon boshqaruvchilari eski PID chiqqanda uni ham o'chirishi yoki kuzatmasligi mumkin. Bunday
+# muhitda RESTART_HANDOVER=0 qoldiring yoki ishchilarni o'zi qayta ishga tushiradigan BOT_WORKERS>1
+# nazoratchisidan foydalaning.
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 20))
+RESTART_HANDOVER = os.getenv("RESTART_HANDOVER", "0") == "1"
+HANDOVER_TIMEOUT = float(os.getenv("HANDOVER_TIMEOUT", 60))
+HANDOVER_FILE = f"pending_updates_{WORKER_INDEX}.json"
+
+# Tez ishga tushish: JSON ombori uchun katalog va foydalanuvchilarning ikkilik nusxasi
+# hamda oxirgi o'rnatilgan webhook izi (set_webhook keraksiz chaqirilmasligi uchun)
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "snapshot.bin")
+WEBHOOK_STATE_FILE = os.getenv("WEBHOOK_STATE_FILE", "webhook.state")
 
 # Logger sozlamalari
 logging.basicConfig(
@@ -38,6 +174,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Ishga tushish bosqichlari davomiyligini yig'ib, oxirida bitta qatorda log qiladi
+class StartupTimer:
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.steps = []
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    def report(self) -> None:
+        steps = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.steps)
+        logger.info(f"Ishga tushish vaqtlari: {steps}, jami {time.perf_counter() - self.started:.3f}s")
+
+startup_timer = StartupTimer()
+
+# Metrikalar (Prometheus matn formati) webhook portida emas, alohida ichki portda
+# /metrics orqali beriladi: METRICS_PORT + jarayon raqami. METRICS_PORT=0 o'chiradi.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._values.get(label_values)
+        if series is None:
+            # [har bir bucket uchun soni..., yig'indi, umumiy soni]
+            series = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in list(self._values.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, getter):
+        self.name = name
+        self.help_text = help_text
+        self.getter = getter
+
+    def render(self) -> list:
+        try:
+            value = self.getter()
+        except Exception as e:
+            logger.error(f"{self.name} metrikasini olishda xatolik: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HANDLER_LATENCY = metrics.register(Histogram(
+    "bot_handler_duration_seconds", "Handler bajarilish vaqti", ("handler",)))
+HANDLER_ERRORS = metrics.register(Counter(
+    "bot_handler_errors_total", "Handlerda yuz bergan xatoliklar", ("handler",)))
+API_LATENCY = metrics.register(Histogram(
+    "bot_api_request_duration_seconds", "Bot API so'rovlari vaqti", ("method",)))
+API_ERRORS = metrics.register(Counter(
+    "bot_api_errors_total", "Bot API xatoliklari", ("method",)))
+SAVE_LATENCY = metrics.register(Histogram(
+    "bot_save_duration_seconds", "Faylni diskka yozish vaqti", ("file",)))
+FLOOD_DROPPED = metrics.register(Counter(
+    "bot_flood_dropped_total", "Limitdan oshgani uchun tashlab yuborilgan yangilanishlar", ("kind",)))
+SAVE_BYTES = metrics.register(Counter(
+    "bot_save_bytes_total", "Diskka yozilgan baytlar", ("file",)))
+MEMBERSHIP_CHECKED = metrics.register(Counter(
+    "bot_membership_reconciled_total", "getChatMember bilan solishtirilgan a'zolik yozuvlari", ("channel",)))
+MEMBERSHIP_DRIFT = metrics.register(Counter(
+    "bot_membership_drift_total", "Solishtirishda noto'g'ri chiqib tuzatilgan a'zolik yozuvlari", ("channel",)))
+
+# Bot API chaqiruvlarini metod bo'yicha o'lchaydi (getChatMember, sendVideo, ...)
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            API_ERRORS.inc(api_method)
+        return code, payload
+
 # JSON fayl operatsiyalari
 def load_json(filename):
     file_path = os.path.join(os.getcwd(), filename)
@@ -55,20 +332,1820 @@ def load_json(filename):
         logger.error(f"{filename} faylini o'qishda xatolik: {e}")
         return {} if filename in ["movies.json", "users.json"] else []
 
+# Vaqtinchalik faylga yozib, fsync qilib, keyin nomini almashtiradi -
+# yozish o'rtasida jarayon to'xtasa ham eski fayl butun qoladi
+def write_file_atomic(file_path, payload: bytes) -> None:
+    started = time.perf_counter()
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+    filename = os.path.basename(file_path)
+    SAVE_LATENCY.observe(time.perf_counter() - started, filename)
+    SAVE_BYTES.inc(filename, amount=len(payload))
+
+# JSON ga to'g'ridan-to'g'ri aylanmaydigan obyektlar (UserRegistry) to_json() orqali yoziladi
+def _json_default(value):
+    if hasattr(value, "to_json"):
+        return value.to_json()
+    raise TypeError(f"{type(value).__name__} JSON ga aylantirilmaydi")
+
+def dump_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=4, default=_json_default).encode("utf-8")
+
 def save_json(filename, data):
     file_path = os.path.join(os.getcwd(), filename)
     try:
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        write_file_atomic(file_path, dump_json(data))
         logger.info(f"{filename} fayliga muvaffaqiyatli yozildi")
     except Exception as e:
         logger.error(f"{filename} fayliga yozishda xatolik: {e}")
         raise
 
-# Ma'lumotlarni yuklash
-movies_data = load_json("movies.json")
-CHANNELS = load_json("channels.json")
-users_data = load_json("users.json")
+# Ikkilik nusxa: sarlavha (bo'limlar jadvali) va marshal qilingan bo'limlar. Fayl mmap
+# qilinadi, har bir bo'lim faqat so'ralganda ochiladi. Nusxa manba fayllarning o'lchami
+# va mtime i yozilgandagidek bo'lsagina ishlatiladi, aks holda JSON dan o'qiladi.
+class Snapshot:
+    MAGIC = b"BOTSNAP2"
+
+    def __init__(self, path: str):
+        self.path = os.path.join(os.getcwd(), path)
+        self._mmap = None
+        self._sections = {}
+
+    @staticmethod
+    def source_key(filenames) -> list:
+        key = []
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(os.getcwd(), filename))
+            except FileNotFoundError:
+                key.append(None)
+            else:
+                key.append([stat.st_size, stat.st_mtime_ns])
+        return key
+
+    def open(self, key) -> bool:
+        try:
+            with open(self.path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return False
+        try:
+            start = len(self.MAGIC)
+            if mapped[:start] != self.MAGIC:
+                raise ValueError("noto'g'ri format")
+            header_end = start + 4 + int.from_bytes(mapped[start:start + 4], "little")
+            header = json.loads(mapped[start + 4:header_end])
+            if header["key"] != key:
+                raise ValueError("manba fayllar o'zgargan")
+        except Exception as e:
+            logger.info(f"Ikkilik nusxa ishlatilmaydi: {e}")
+            mapped.close()
+            return False
+        self._mmap = mapped
+        self._sections = {name: (header_end + offset, size) for name, (offset, size) in header["sections"].items()}
+        return True
+
+    def has(self, name: str) -> bool:
+        return name in self._sections
+
+    def section(self, name: str):
+        offset, size = self._sections[name]
+        with memoryview(self._mmap)[offset:offset + size] as view:
+            return marshal.loads(view)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._sections = {}
+
+    def write(self, key, sections: dict) -> None:
+        blobs, table, offset = [], {}, 0
+        for name, value in sections.items():
+            blob = marshal.dumps(value)
+            table[name] = (offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+        header = json.dumps({"key": key, "sections": table}).encode("utf-8")
+        write_file_atomic(self.path, b"".join([self.MAGIC, len(header).to_bytes(4, "little"), header, *blobs]))
+
+# Foydalanuvchilar ro'yxati ustunlar ko'rinishida: user_id -> qator raqami lug'ati va har bir
+# maydon uchun alohida massiv. Har bir foydalanuvchi uchun dict va satr kalitlar bo'lmagani
+# uchun xotira bir necha barobar kam ketadi. ID lar int, qo'shilgan sana epoch soniyalarda
+# (mikrosekundlari bilan, 0 - noma'lum) va asl UTC siljishi soniyalarda, ism va username lar
+# intern qilinadi. Diskdagi formatlar o'zgarmaydi.
+class UserRegistry:
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self._rows = {}
+        self._ids = array("q")
+        self._joined = array("d")
+        self._offsets = array("i")
+        self._active = bytearray()
+        self._usernames = []
+        self._first_names = []
+        self.active_count = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._rows
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    @staticmethod
+    def _intern(value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+    # (timestamp, UTC siljishi soniyalarda). Siljishsiz (naive) sana jarayonning mahalliy
+    # vaqti deb olinadi va mahalliy siljish bilan saqlanadi; noto'g'ri qiymat - (0.0, 0)
+    @staticmethod
+    def parse_date(value) -> tuple:
+        try:
+            date = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return 0.0, 0
+        if date.tzinfo is None:
+            date = date.astimezone()
+        return date.timestamp(), int(date.utcoffset().total_seconds())
+
+    # Asl siljish va aniqlik bilan: mikrosekundlar faqat nol bo'lmasa yoziladi
+    @staticmethod
+    def format_date(timestamp: float, offset: int = 0):
+        return str(datetime.fromtimestamp(timestamp, timezone(timedelta(seconds=offset)))) if timestamp else None
+
+    # Yangi foydalanuvchi bo'lsa True; mavjud bo'lsa maydonlari yangilanadi
+    def add(self, user_id: int, username, first_name, joined: float, active: bool = True, offset: int = 0) -> bool:
+        row = self._rows.get(user_id)
+        if row is not None:
+            self._usernames[row] = self._intern(username)
+            self._first_names[row] = self._intern(first_name)
+            self._joined[row] = joined
+            self._offsets[row] = offset
+            self.set_active(user_id, active)
+            return False
+        self._rows[user_id] = len(self._ids)
+        self._ids.append(user_id)
+        self._joined.append(joined)
+        self._offsets.append(offset)
+        self._active.append(bool(active))
+        self._usernames.append(self._intern(username))
+        self._first_names.append(self._intern(first_name))
+        self.active_count += bool(active)
+        return True
+
+    # users.json / users jadvalidagi ko'rinishdan
+    def add_json(self, user_id, user: dict) -> bool:
+        joined, offset = self.parse_date(user.get("joined_date"))
+        return self.add(int(user_id), user.get("username"), user.get("first_name"),
+                        joined, user.get("active", True), offset)
+
+    def get(self, user_id: int):
+        row = self._rows.get(user_id)
+        if row is None:
+            return None
+        return self._row_json(row)
+
+    def _row_json(self, row: int) -> dict:
+        return {
+            "username": self._usernames[row],
+            "first_name": self._first_names[row],
+            "joined_date": self.format_date(self._joined[row], self._offsets[row]),
+            "active": bool(self._active[row]),
+        }
+
+    def is_active(self, user_id: int) -> bool:
+        row = self._rows.get(user_id)
+        return row is not None and bool(self._active[row])
+
+    # Holat o'zgargan bo'lsa True
+    def set_active(self, user_id: int, active: bool) -> bool:
+        row = self._rows.get(user_id)
+        if row is None or bool(self._active[row]) == active:
+            return False
+        self._active[row] = active
+        self.active_count += 1 if active else -1
+        return True
+
+    def active_ids(self) -> list:
+        return list(compress(self._ids, self._active))
+
+    # users.json formati. Yozish oqimida copy() dan olingan nusxa uchun chaqiriladi
+    def to_json(self) -> dict:
+        return {str(user_id): self._row_json(row) for row, user_id in enumerate(self._ids)}
+
+    # Yozish oqimiga beriladigan nusxa: ustunlar asosiy oqimda ko'chiriladi, keyingi
+    # o'zgarishlar serializatsiyaga tegmaydi. _rows kerak emas, shuning uchun ko'chirilmaydi.
+    def copy(self):
+        registry = UserRegistry()
+        registry._ids = self._ids[:]
+        registry._joined = self._joined[:]
+        registry._offsets = self._offsets[:]
+        registry._active = self._active[:]
+        registry._usernames = self._usernames[:]
+        registry._first_names = self._first_names[:]
+        registry.active_count = self.active_count
+        return registry
+
+    # Ikkilik nusxa uchun: massivlar baytlar ko'rinishida, satrlar ro'yxat
+    def columns(self) -> dict:
+        return {
+            "ids": self._ids.tobytes(),
+            "joined": self._joined.tobytes(),
+            "offsets": self._offsets.tobytes(),
+            "active": bytes(self._active),
+            "usernames": self._usernames,
+            "first_names": self._first_names,
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        registry = cls()
+        registry._ids.frombytes(columns["ids"])
+        registry._joined.frombytes(columns["joined"])
+        registry._offsets.frombytes(columns["offsets"])
+        registry._active = bytearray(columns["active"])
+        registry._usernames = columns["usernames"]
+        registry._first_names = columns["first_names"]
+        registry._rows = {user_id: row for row, user_id in enumerate(registry._ids)}
+        registry.active_count = registry._active.count(1)
+        return registry
+
+    # Qatorlar: (user_id, username, first_name, joined, offset, active); ID lar takrorlanmaydi
+    @classmethod
+    def from_rows(cls, rows: list):
+        registry = cls()
+        if not rows:
+            return registry
+        ids, usernames, first_names, joined, offsets, active = zip(*rows)
+        registry._ids = array("q", ids)
+        registry._joined = array("d", joined)
+        registry._offsets = array("i", offsets)
+        registry._active = bytearray(active)
+        registry._usernames = [value if value is None else sys.intern(value) for value in usernames]
+        registry._first_names = [value if value is None else sys.intern(value) for value in first_names]
+        registry._rows = dict(zip(ids, range(len(ids))))
+        registry.active_count = registry._active.count(1)
+        return registry
+
+    # Million qatorli yuklashda GC yangi obyektlarni qayta-qayta ko'rib chiqib, vaqtni
+    # ikki barobar oshiradi; yaratilayotgan obyektlarda sikl yo'q, shuning uchun u o'chiriladi
+    @classmethod
+    def from_json(cls, users: dict):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls.from_rows([
+                (int(user_id), user.get("username"), user.get("first_name"),
+                 *cls.parse_date(user.get("joined_date")), bool(user.get("active", True)))
+                for user_id, user in users.items()
+            ])
+        finally:
+            if enabled:
+                gc.enable()
+
+# Diskka yozishni alohida oqimda bajaradi. Bir faylga navbatda turgan bir nechta
+# yozuv bittaga birlashtiriladi; chaqiruvchi yozuv tugashini await qiladi.
+# write_json ga asosiy oqim o'zgartirmaydigan nusxa berilishi kerak.
+class PersistenceWriter:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._files = OrderedDict()
+        self._calls = []
+        self._busy = 0
+        self._thread = None
+        self._closed = False
+        self.writes = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self.last_write_seconds = 0.0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+            self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._files) + len(self._calls) + self._busy
+
+    async def write_json(self, filename: str, data) -> None:
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if filename in self._files:
+                # Oldingi yozuv hali boshlanmagan - eng so'nggi holat bilan birlashtiriladi
+                self._files[filename][0] = data
+                self._files[filename][1].append((loop, future))
+            else:
+                self._files[filename] = [data, [(loop, future)]]
+            self._cond.notify()
+        await future
+
+    async def call(self, func, *args):
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            self._calls.append((func, args, [(loop, future)]))
+            self._cond.notify()
+        return await future
+
+    async def drain(self) -> None:
+        # Navbatdagi barcha yozuvlar tugashini kutadi
+        while self.queue_depth:
+            await asyncio.sleep(0.01)
+
+    def close(self, timeout: float = 10) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "writes": self.writes,
+            "bytes_written": self.bytes_written,
+            "avg_write_ms": self.write_seconds / self.writes * 1000 if self.writes else 0.0,
+            "last_write_ms": self.last_write_seconds * 1000,
+        }
+
+    @staticmethod
+    def _resolve(waiters, result=None, error=None) -> None:
+        def set_result(future):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(set_result, future)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._files and not self._calls and not self._closed:
+                    self._cond.wait()
+                if self._calls:
+                    func, args, waiters = self._calls.pop(0)
+                    job = ("call", func, args)
+                elif self._files:
+                    filename, (data, waiters) = self._files.popitem(last=False)
+                    job = ("file", filename, data)
+                else:
+                    return
+                self._busy += 1
+            started = time.perf_counter()
+            try:
+                if job[0] == "call":
+                    result = job[1](*job[2])
+                else:
+                    payload = dump_json(job[2])
+                    write_file_atomic(os.path.join(os.getcwd(), job[1]), payload)
+                    self.bytes_written += len(payload)
+                    result = None
+                elapsed = time.perf_counter() - started
+                self.writes += 1
+                self.write_seconds += elapsed
+                self.last_write_seconds = elapsed
+                self._resolve(waiters, result=result)
+            except Exception as e:
+                logger.error(f"Diskka yozishda xatolik: {e}")
+                self._resolve(waiters, error=e)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+persistence_writer = PersistenceWriter()
+
+# JSON ombori: har bir o'zgarishda tegishli fayl fon oqimida to'liq qayta yoziladi
+class JsonStorage:
+    SNAPSHOT_SOURCES = ("movies.json", "users.json")
+
+    def __init__(self):
+        self._states = None
+        self._movies = None
+        self._log_records = 0
+        self._membership_records = 0
+        self.snapshot = Snapshot(SNAPSHOT_FILE)
+        if self.snapshot.open(Snapshot.source_key(self.SNAPSHOT_SOURCES)):
+            logger.info("Ma'lumotlar ikkilik nusxadan yuklanmoqda")
+
+    def load_movies(self) -> dict:
+        if self.snapshot.has("movies"):
+            return self.snapshot.section("movies")
+        return load_json("movies.json")
+
+    # Oxirgi yuklanadigan bo'lim: nusxa shundan keyin yopiladi
+    def load_users(self) -> UserRegistry:
+        if self.snapshot.has("user_columns"):
+            users = UserRegistry.from_columns(self.snapshot.section("user_columns"))
+        else:
+            users = UserRegistry.from_json(load_json("users.json"))
+        self.snapshot.close()
+        return users
+
+    # To'xtashdan oldin, barcha yozuvlar diskka tushgandan keyin chaqiriladi
+    def write_snapshot(self) -> None:
+        try:
+            self.snapshot.write(Snapshot.source_key(self.SNAPSHOT_SOURCES), {
+                "movies": movies_data,
+                "user_columns": user_registry.columns(),
+            })
+            logger.info("Ikkilik nusxa saqlandi")
+        except Exception as e:
+            logger.error(f"Ikkilik nusxani saqlashda xatolik: {e}")
+
+    def load_channels(self) -> list:
+        return load_json("channels.json")
+
+    @staticmethod
+    def _copy_movie(movie: dict) -> dict:
+        if "part_data" in movie:
+            return dict(movie, part_data=[dict(part) for part in movie["part_data"]])
+        return dict(movie)
+
+    # Yozish oqimi serializatsiya qilayotganda asosiy oqim movies_data ni o'zgartirishda
+    # davom etadi, shuning uchun unga nusxa beriladi. Yozuvlar nusxasi _movies da saqlanadi
+    # va faqat o'zgargan raqamlarniki yangilanadi: har bir o'zgarish omborga shu raqam bilan
+    # keladi (SQLite ham aynan shunga tayanadi). Birinchi yozuvda butun katalog ko'chiriladi.
+    def _movies_copy(self, numbers) -> dict:
+        if self._movies is None:
+            self._movies = {number: self._copy_movie(movie) for number, movie in movies_data.items()}
+        else:
+            for number in numbers:
+                movie = movies_data.get(number)
+                if movie is None:
+                    self._movies.pop(number, None)
+                else:
+                    self._movies[number] = self._copy_movie(movie)
+        return dict(self._movies)
+
+    async def save_movie(self, number: str, movie: dict) -> None:
+        await persistence_writer.write_json("movies.json", self._movies_copy([number]))
+
+    async def add_part(self, number: str, index: int, part: dict) -> None:
+        await persistence_writer.write_json("movies.json", self._movies_copy([number]))
+
+    async def delete_movie(self, number: str) -> None:
+        await persistence_writer.write_json("movies.json", self._movies_copy([number]))
+
+    async def set_file_ids(self, updates: dict) -> None:
+        await persistence_writer.write_json("movies.json", self._movies_copy({number for number, _ in updates}))
+
+    async def add_views(self, counts: dict) -> None:
+        await persistence_writer.write_json("movies.json", self._movies_copy(counts))
+
+    async def add_user(self, user_id: str, user: dict) -> None:
+        await persistence_writer.write_json("users.json", user_registry.copy())
+
+    async def set_user_active(self, user_id: str, active: bool) -> None:
+        await persistence_writer.write_json("users.json", user_registry.copy())
+
+    async def set_users_active(self, user_ids: list, active: bool) -> None:
+        await persistence_writer.write_json("users.json", user_registry.copy())
+
+    async def add_channel(self, channel) -> None:
+        await persistence_writer.write_json("channels.json", list(CHANNELS))
+
+    async def remove_channel(self, channel) -> None:
+        await persistence_writer.write_json("channels.json", list(CHANNELS))
+
+    # Jurnal yozuvlari tartib bilan qaytariladi. Oxirgi yozuv uzilib qolgan bo'lsa
+    # (yozish paytida to'xtash) jurnal undan oldingi joyda kesiladi.
+    @staticmethod
+    def _read_log(filename: str) -> list:
+        records = []
+        log_path = os.path.join(os.getcwd(), filename)
+        if os.path.exists(log_path):
+            with open(log_path, "r+b") as file:
+                valid = 0
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"{filename} oxirgi yozuvi buzilgan, tashlab yuborildi")
+                        file.truncate(valid)
+                        break
+                    valid += len(line)
+        return records
+
+    # {"users": {id: [data, updated]}, "conversations": {nom: {kalit: [holat, updated]}}}.
+    # Asosiy fayl ustiga jurnaldagi yozuvlar tartib bilan qo'llanadi.
+    def _user_states(self) -> dict:
+        if self._states is None:
+            self._states = load_json(USER_STATE_FILE) or {}
+            self._states.setdefault("users", {})
+            self._states.setdefault("conversations", {})
+            for record in self._read_log(USER_STATE_LOG):
+                self._apply_states(self._states, record["u"], record["d"], record["c"], record["t"])
+                self._log_records += 1
+        return self._states
+
+    @staticmethod
+    def _apply_states(states: dict, upserts: dict, deletes, conversations: list, now: float) -> None:
+        for user_id, data in upserts.items():
+            states["users"][str(user_id)] = [data, now]
+        for user_id in deletes:
+            states["users"].pop(str(user_id), None)
+        for name, key, state in conversations:
+            entries = states["conversations"].setdefault(name, {})
+            if state is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = [state, now]
+
+    def load_user_states(self, since: float) -> list:
+        return [(int(user_id), data, updated) for user_id, (data, updated) in self._user_states()["users"].items()
+                if updated >= since]
+
+    def load_conversations(self, name: str, since: float) -> list:
+        return [(key, state) for key, (state, updated) in self._user_states()["conversations"].get(name, {}).items()
+                if updated >= since]
+
+    # Faqat shu paketdagi o'zgarishlar jurnal oxiriga bitta qator bo'lib qo'shiladi
+    async def save_user_states(self, upserts: dict, deletes: set, conversations: dict, now: float) -> None:
+        states = self._user_states()
+        changes = [[name, key, state] for (name, key), state in conversations.items()]
+        self._apply_states(states, upserts, deletes, changes, now)
+        record = {"t": now, "u": {str(user_id): data for user_id, data in upserts.items()},
+                  "d": [str(user_id) for user_id in deletes], "c": changes}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        await persistence_writer.call(self._append_log, USER_STATE_LOG, line.encode("utf-8"))
+        self._log_records += 1
+        if self._log_records >= USER_STATE_COMPACT_RECORDS:
+            await self._compact_user_states()
+
+    async def prune_user_states(self, before: float) -> None:
+        states = self._user_states()
+        count = len(states["users"]) + sum(len(entries) for entries in states["conversations"].values())
+        states["users"] = {user_id: entry for user_id, entry in states["users"].items() if entry[1] >= before}
+        for name, entries in states["conversations"].items():
+            states["conversations"][name] = {key: entry for key, entry in entries.items() if entry[1] >= before}
+        pruned = count - len(states["users"]) - sum(len(entries) for entries in states["conversations"].values())
+        if pruned or self._log_records:
+            await self._compact_user_states()
+
+    # Yozuvlar qiymati almashtiriladi, o'zgartirilmaydi: sayoz nusxani yozish
+    # oqimida xavfsiz serializatsiya qilish mumkin
+    async def _compact_user_states(self) -> None:
+        states = self._user_states()
+        copy = {"users": dict(states["users"]),
+                "conversations": {name: dict(entries) for name, entries in states["conversations"].items()}}
+        self._log_records = 0
+        await persistence_writer.call(self._write_compacted_states, copy)
+
+    @staticmethod
+    def _append_log(filename: str, payload: bytes) -> None:
+        with open(os.path.join(os.getcwd(), filename), "ab") as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+
+    # Jurnal asosiy fayl yozilgandan keyin bo'shatiladi: oraliqda to'xtasa jurnal
+    # qayta qo'llanadi, bu esa natijani o'zgartirmaydi
+    @staticmethod
+    def _write_compacted_states(states: dict) -> None:
+        write_file_atomic(os.path.join(os.getcwd(), USER_STATE_FILE),
+                          json.dumps(states, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with open(os.path.join(os.getcwd(), USER_STATE_LOG), "wb"):
+            pass
+
+    # MEMBERSHIP_FILE: {kanal: [a'zolar, chiqib ketganlar]}, ustiga MEMBERSHIP_LOG dagi
+    # {"c": [[kanal, user_id, a'zo], ...], "d": [o'chirilgan kanallar]} yozuvlari qo'llanadi
+    def load_memberships(self) -> list:
+        channels = {
+            channel: {**dict.fromkeys(members, True), **dict.fromkeys(left, False)}
+            for channel, (members, left) in (load_json(MEMBERSHIP_FILE) or {}).items()
+        }
+        self._membership_records = 0
+        for record in self._read_log(MEMBERSHIP_LOG):
+            for channel, user_id, member in record["c"]:
+                channels.setdefault(channel, {})[user_id] = member
+            for channel in record["d"]:
+                channels.pop(channel, None)
+            self._membership_records += 1
+        return [(channel, user_id, member) for channel, users in channels.items() for user_id, member in users.items()]
+
+    # Har flushda jurnalga faqat o'zgarganlar qo'shiladi. To'liq indeks kamdan-kam yoziladi:
+    # asosiy oqimda to'plamlar ko'chiriladi, ro'yxat va JSON yozish oqimida tuziladi.
+    async def save_memberships(self, changes: dict, dropped: set) -> None:
+        record = {"c": [[channel, user_id, member] for (channel, user_id), member in changes.items()],
+                  "d": sorted(dropped)}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        await persistence_writer.call(self._append_log, MEMBERSHIP_LOG, line.encode("utf-8"))
+        self._membership_records += 1
+        if self._membership_records >= MEMBERSHIP_COMPACT_RECORDS:
+            self._membership_records = 0
+            await persistence_writer.call(self._write_compacted_memberships, membership_index.dump())
+
+    # Jurnal asosiy fayl yozilgandan keyin bo'shatiladi (qayta qo'llash natijani o'zgartirmaydi)
+    @staticmethod
+    def _write_compacted_memberships(channels: dict) -> None:
+        write_file_atomic(os.path.join(os.getcwd(), MEMBERSHIP_FILE), dump_json(
+            {channel: [list(members), list(left)] for channel, (members, left) in channels.items()}))
+        with open(os.path.join(os.getcwd(), MEMBERSHIP_LOG), "wb"):
+            pass
+
+# SQLite ombori: har bir o'zgarish bitta qatorli tranzaksiya
+class SqliteStorage:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS movies (
+            number TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            video_url TEXT,
+            parts INTEGER,
+            views INTEGER NOT NULL DEFAULT 0,
+            file_id TEXT
+        );
+        CREATE TABLE IF NOT EXISTS parts (
+            movie_number TEXT NOT NULL REFERENCES movies(number) ON DELETE CASCADE,
+            idx INTEGER NOT NULL,
+            part_name TEXT,
+            part_url TEXT,
+            file_id TEXT,
+            PRIMARY KEY (movie_number, idx)
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            joined_date TEXT,
+            active INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE INDEX IF NOT EXISTS users_active ON users(active);
+        CREATE TABLE IF NOT EXISTS channels (
+            position INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT,
+            payload TEXT,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS user_state_updated ON user_state(updated);
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state INTEGER NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (name, key)
+        );
+        CREATE TABLE IF NOT EXISTS membership (
+            channel TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            member INTEGER NOT NULL,
+            PRIMARY KEY (channel, user_id)
+        ) WITHOUT ROWID;
+    """
+    # O'zgarishlar jurnalidagi yozuvlar shuncha soniyadan keyin o'chiriladi
+    CHANGES_RETENTION = 3600
+
+    def __init__(self, path: str):
+        self.path = os.path.join(os.getcwd(), path)
+        # Bir nechta jarayon bir bazaga yozganda qulf bo'shashini kutadi
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._upgrade_schema()
+        self._conn.executescript(self.SCHEMA)
+        self._migrate_from_json()
+
+    # Eski bazalarga keyinchalik qo'shilgan ustunlarni qo'shadi
+    def _upgrade_schema(self) -> None:
+        tables = {name for (name,) in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, column, definition in (
+            ("users", "active", "INTEGER NOT NULL DEFAULT 1"),
+            ("movies", "file_id", "TEXT"),
+            ("parts", "file_id", "TEXT"),
+        ):
+            if table not in tables:
+                continue
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _transaction(self, statements) -> None:
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _movie_statements(number: str, movie: dict) -> list:
+        statements = [(
+            "INSERT OR REPLACE INTO movies (number, title, video_url, parts, views, file_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (number, movie["title"], movie.get("video_url"),
+             movie.get("parts", len(movie["part_data"])) if "part_data" in movie else None,
+             movie.get("views", 0), movie.get("file_id")),
+        )]
+        for index, part in enumerate(movie.get("part_data", [])):
+            statements.append((
+                "INSERT OR REPLACE INTO parts (movie_number, idx, part_name, part_url, file_id) VALUES (?, ?, ?, ?, ?)",
+                (number, index, part["part_name"], part["part_url"], part.get("file_id")),
+            ))
+        return statements
+
+    # Boshqa jarayonlar keshlarini yangilashi uchun o'zgarishlar jurnaliga yozuv
+    @staticmethod
+    def _change(kind: str, key=None, payload=None) -> tuple:
+        return (
+            "INSERT INTO changes (origin, kind, key, payload, created) VALUES (?, ?, ?, ?, ?)",
+            (WORKER_INDEX, kind, None if key is None else str(key),
+             None if payload is None else json.dumps(payload, ensure_ascii=False), time.time()),
+        )
+
+    @staticmethod
+    def _decode_channel(value: str):
+        return value if value.startswith("@") else int(value)
+
+    # movies.json / users.json / channels.json dan bir martalik ko'chirish
+    def _migrate_from_json(self) -> None:
+        if self._conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        statements = []
+        for filename in ("movies.json", "users.json", "channels.json"):
+            if not os.path.exists(os.path.join(os.getcwd(), filename)):
+                continue
+            data = load_json(filename)
+            if filename == "movies.json":
+                for number, movie in data.items():
+                    statements.extend(self._movie_statements(number, movie))
+            elif filename == "users.json":
+                for user_id, user in data.items():
+                    statements.append((
+                        "INSERT OR IGNORE INTO users (user_id, username, first_name, joined_date, active) VALUES (?, ?, ?, ?, ?)",
+                        (int(user_id), user.get("username"), user.get("first_name"), user.get("joined_date"),
+                         int(user.get("active", True))),
+                    ))
+            else:
+                for channel in data:
+                    statements.append(("INSERT OR IGNORE INTO channels (channel) VALUES (?)", (str(channel),)))
+        statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(time.time()),)))
+        self._transaction(statements)
+        logger.info(f"JSON fayllar SQLite bazasiga ko'chirildi: {len(statements) - 1} ta yozuv")
+
+    def load_movies(self, number: str = None) -> dict:
+        movie_sql = "SELECT number, title, video_url, parts, views, file_id FROM movies"
+        part_sql = "SELECT movie_number, part_name, part_url, file_id FROM parts"
+        params = ()
+        if number is not None:
+            movie_sql += " WHERE number = ?"
+            part_sql += " WHERE movie_number = ?"
+            params = (number,)
+        movies = {}
+        for number, title, video_url, parts, views, file_id in self._conn.execute(movie_sql, params):
+            if parts is None:
+                movies[number] = {"title": title, "video_url": video_url, "views": views}
+            else:
+                movies[number] = {"title": title, "parts": parts, "part_data": [], "views": views}
+            if file_id:
+                movies[number]["file_id"] = file_id
+        for movie_number, part_name, part_url, file_id in self._conn.execute(
+                part_sql + " ORDER BY movie_number, idx", params):
+            if movie_number in movies and "part_data" in movies[movie_number]:
+                part = {"part_name": part_name, "part_url": part_url}
+                if file_id:
+                    part["file_id"] = file_id
+                movies[movie_number]["part_data"].append(part)
+        return movies
+
+    def load_users(self) -> UserRegistry:
+        return UserRegistry.from_rows([
+            (user_id, username, first_name, *UserRegistry.parse_date(joined_date), bool(active))
+            for user_id, username, first_name, joined_date, active in self._conn.execute(
+                "SELECT user_id, username, first_name, joined_date, active FROM users")
+        ])
+
+    def _load_user(self, user_id: str):
+        row = self._conn.execute(
+            "SELECT username, first_name, joined_date, active FROM users WHERE user_id = ?", (int(user_id),)
+        ).fetchone()
+        if row is None:
+            return None
+        username, first_name, joined_date, active = row
+        return {"username": username, "first_name": first_name, "joined_date": joined_date, "active": bool(active)}
+
+    def load_channels(self) -> list:
+        return [self._decode_channel(channel) for (channel,) in
+                self._conn.execute("SELECT channel FROM channels ORDER BY position")]
+
+    # SQLite o'zi tez ochiladi, alohida nusxa kerak emas
+    def write_snapshot(self) -> None:
+        pass
+
+    def last_change_id(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+    def _read_changes(self, after_id: int) -> list:
+        return self._conn.execute(
+            "SELECT id, origin, kind, key, payload FROM changes WHERE id > ? ORDER BY id", (after_id,)
+        ).fetchall()
+
+    async def read_changes(self, after_id: int) -> list:
+        return await persistence_writer.call(self._read_changes, after_id)
+
+    async def load_movie(self, number: str):
+        return (await persistence_writer.call(self.load_movies, number)).get(number)
+
+    async def load_user(self, user_id: str):
+        return await persistence_writer.call(self._load_user, user_id)
+
+    async def reload_channels(self) -> list:
+        return await persistence_writer.call(self.load_channels)
+
+    async def publish(self, kind: str, payload: dict) -> None:
+        await persistence_writer.call(self._transaction, [self._change(kind, payload=payload)])
+
+    async def prune_changes(self) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("DELETE FROM changes WHERE created < ?", (time.time() - self.CHANGES_RETENTION,))
+        ])
+
+    async def save_movie(self, number: str, movie: dict) -> None:
+        await persistence_writer.call(
+            self._transaction, self._movie_statements(number, movie) + [self._change("movie", number)]
+        )
+
+    async def add_part(self, number: str, index: int, part: dict) -> None:
+        await persistence_writer.call(self._transaction, [(
+            "INSERT OR REPLACE INTO parts (movie_number, idx, part_name, part_url) VALUES (?, ?, ?, ?)",
+            (number, index, part["part_name"], part["part_url"]),
+        ), self._change("movie", number)])
+
+    async def delete_movie(self, number: str) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("DELETE FROM movies WHERE number = ?", (number,)), self._change("movie", number)
+        ])
+
+    # {(anime, qism): file_id}; har bir anime uchun bitta o'zgarish yozuvi
+    async def set_file_ids(self, updates: dict) -> None:
+        statements = []
+        for (number, part_index), file_id in updates.items():
+            if part_index is None:
+                statements.append(("UPDATE movies SET file_id = ? WHERE number = ?", (file_id, number)))
+            else:
+                statements.append(("UPDATE parts SET file_id = ? WHERE movie_number = ? AND idx = ?",
+                                   (file_id, number, part_index)))
+        statements += [self._change("movie", number) for number in {number for number, _ in updates}]
+        await persistence_writer.call(self._transaction, statements)
+
+    async def add_views(self, counts: dict) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("UPDATE movies SET views = views + ? WHERE number = ?", (count, number))
+            for number, count in counts.items()
+        ])
+
+    async def add_user(self, user_id: str, user: dict) -> None:
+        await persistence_writer.call(self._transaction, [(
+            "INSERT OR IGNORE INTO users (user_id, username, first_name, joined_date) VALUES (?, ?, ?, ?)",
+            (int(user_id), user["username"], user["first_name"], user["joined_date"]),
+        ), self._change("user", user_id)])
+
+    async def set_user_active(self, user_id: str, active: bool) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("UPDATE users SET active = ? WHERE user_id = ?", (int(active), int(user_id))),
+            self._change("user", user_id),
+        ])
+
+    # Bir nechta foydalanuvchi uchun bitta tranzaksiya va bitta o'zgarish yozuvi
+    async def set_users_active(self, user_ids: list, active: bool) -> None:
+        statements = [("UPDATE users SET active = ? WHERE user_id = ?", (int(active), int(user_id)))
+                      for user_id in user_ids]
+        statements.append(self._change("user_active", payload={"active": active, "ids": list(user_ids)}))
+        await persistence_writer.call(self._transaction, statements)
+
+    async def add_channel(self, channel) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("INSERT OR IGNORE INTO channels (channel) VALUES (?)", (str(channel),)), self._change("channels")
+        ])
+
+    async def remove_channel(self, channel) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("DELETE FROM channels WHERE channel = ?", (str(channel),)), self._change("channels")
+        ])
+
+    def load_user_states(self, since: float) -> list:
+        return self._conn.execute(
+            "SELECT user_id, data, updated FROM user_state WHERE updated >= ?", (since,)
+        ).fetchall()
+
+    def load_conversations(self, name: str, since: float) -> list:
+        return self._conn.execute(
+            "SELECT key, state FROM conversation_state WHERE name = ? AND updated >= ?", (name, since)
+        ).fetchall()
+
+    async def save_user_states(self, upserts: dict, deletes: set, conversations: dict, now: float) -> None:
+        statements = [
+            ("INSERT OR REPLACE INTO user_state (user_id, data, updated) VALUES (?, ?, ?)", (user_id, data, now))
+            for user_id, data in upserts.items()
+        ]
+        statements += [("DELETE FROM user_state WHERE user_id = ?", (user_id,)) for user_id in deletes]
+        for (name, key), state in conversations.items():
+            if state is None:
+                statements.append(("DELETE FROM conversation_state WHERE name = ? AND key = ?", (name, key)))
+            else:
+                statements.append((
+                    "INSERT OR REPLACE INTO conversation_state (name, key, state, updated) VALUES (?, ?, ?, ?)",
+                    (name, key, state, now),
+                ))
+        await persistence_writer.call(self._transaction, statements)
+
+    async def prune_user_states(self, before: float) -> None:
+        await persistence_writer.call(self._transaction, [
+            ("DELETE FROM user_state WHERE updated < ?", (before,)),
+            ("DELETE FROM conversation_state WHERE updated < ?", (before,)),
+        ])
+
+    def load_memberships(self) -> list:
+        return self._conn.execute("SELECT channel, user_id, member FROM membership").fetchall()
+
+    async def save_memberships(self, changes: dict, dropped: set) -> None:
+        statements = [("DELETE FROM membership WHERE channel = ?", (channel,)) for channel in dropped]
+        statements += [
+            ("INSERT OR REPLACE INTO membership (channel, user_id, member) VALUES (?, ?, ?)", (channel, user_id, int(member)))
+            for (channel, user_id), member in changes.items()
+        ]
+        if changes:
+            statements.append(self._change("membership", payload=[
+                [channel, user_id, member] for (channel, user_id), member in changes.items()
+            ]))
+        await persistence_writer.call(self._transaction, statements)
+
+# Ma'lumotlar import paytida emas, load_data() da yuklanadi: BOT_WORKERS > 1 dagi nazoratchi
+# jarayon ularni umuman yuklamaydi
+storage = None
+movies_data = {}
+CHANNELS = []
+# Faollik ham registrda saqlanadi: broadcast va statistika to'liq skanerlashsiz ishlaydi
+user_registry = UserRegistry()
+
+async def set_user_active(user_id: int, active: bool) -> None:
+    if user_registry.set_active(user_id, active):
+        await storage.set_user_active(str(user_id), active)
+
+# Foydalanuvchi botni bloklagan yoki akkaunti o'chirilganini bildiruvchi xatolik
+def is_dead_chat_error(error: Exception) -> bool:
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+# Ko'rishlarni xotirada yig'ib, vaqti-vaqti bilan movies.json ga yozadi
+class ViewCounter:
+    def __init__(self, interval: float, threshold: int):
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}
+        self._pending_total = 0
+        self._flush_scheduled = False
+
+    def increment(self, number: str) -> None:
+        self._pending[number] = self._pending.get(number, 0) + 1
+        self._pending_total += 1
+        if self._pending_total >= self.threshold and not self._flush_scheduled:
+            # Yozish joriy so'rov javobidan keyinga qoldiriladi
+            self._flush_scheduled = True
+            asyncio.get_running_loop().create_task(self.flush())
+
+    def views(self, number: str) -> int:
+        video_info = movies_data.get(number) or {}
+        return video_info.get("views", 0) + self._pending.get(number, 0)
+
+    async def flush(self) -> None:
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        # O'chirilgan animelar uchun yig'ilgan ko'rishlar tashlab yuboriladi
+        pending = {number: count for number, count in self._pending.items() if number in movies_data}
+        self._pending, self._pending_total = {}, 0
+        for number, count in pending.items():
+            movies_data[number]["views"] = movies_data[number].get("views", 0) + count
+        try:
+            await storage.add_views(pending)
+        except Exception:
+            logger.error(f"Ko'rishlar saqlanmadi, {sum(pending.values())} ta ko'rish keyingi safar yoziladi")
+            for number, count in pending.items():
+                if number in movies_data:
+                    movies_data[number]["views"] -= count
+                    self._pending[number] = self._pending.get(number, 0) + count
+                    self._pending_total += count
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+view_counter = ViewCounter(VIEWS_FLUSH_INTERVAL, VIEWS_FLUSH_THRESHOLD)
+
+# Yangi yoki rad etilgan file_id lar xotirada darhol yangilanadi, omborga esa
+# vaqti-vaqti bilan bitta yozuv bilan tushadi. Yozishda qiymat movies_data dan
+# olinadi, shuning uchun bir videoning ketma-ket o'zgarishlari bittaga birlashadi.
+class FileIdBuffer:
+    def __init__(self, interval: float, threshold: int):
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = set()
+        self._flush_scheduled = False
+
+    def add(self, number: str, part_index) -> None:
+        self._pending.add((number, part_index))
+        if len(self._pending) >= self.threshold and not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, set()
+        updates = {}
+        for number, part_index in pending:
+            # O'chirilgan anime yoki qismlar tashlab yuboriladi
+            try:
+                entry, _ = video_entry(number, part_index)
+            except (KeyError, IndexError):
+                continue
+            updates[(number, part_index)] = entry.get("file_id")
+        if not updates:
+            return
+        try:
+            await storage.set_file_ids(updates)
+        except Exception as e:
+            logger.error(f"file_id lar saqlanmadi ({len(updates)} ta), keyingi safar yoziladi: {e}")
+            self._pending |= set(updates)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+file_id_buffer = FileIdBuffer(FILE_ID_FLUSH_INTERVAL, FILE_ID_FLUSH_THRESHOLD)
+
+# Yangi foydalanuvchilarni yig'ib, kanalga davriy yig'ma xabar yuboradi. /start javobi
+# xabar yuborilishini kutmaydi. RetryAfter kelsa yig'ilganlar saqlanib, yuborish
+# ko'rsatilgan vaqtgacha to'xtatiladi; shu orada kelganlar keyingi xabarga qo'shiladi.
+class JoinNotifier:
+    def __init__(self, interval: float, max_events: int, max_profiles: int):
+        self.interval = interval
+        self.max_events = max_events
+        self.max_profiles = max_profiles
+        self._count = 0
+        self._profiles = []
+        self._paused_until = 0.0
+        self._wakeup = None
+
+    def add(self, first_name: str, username: str, profile_url: str) -> None:
+        if not NOTIFICATION_CHANNEL_ID:
+            return
+        self._count += 1
+        if len(self._profiles) < self.max_profiles:
+            self._profiles.append((first_name, username, profile_url))
+        if self._count >= self.max_events and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _render(self, count: int, profiles: list) -> str:
+        lines = [f"Yangi foydalanuvchilar: {count} ta"]
+        for i, (first_name, username, profile_url) in enumerate(profiles, 1):
+            lines.append(f"{i}. {first_name} (@{username}) - {profile_url}")
+        if count > len(profiles):
+            lines.append(f"... va yana {count - len(profiles)} ta")
+        return "\n".join(lines)
+
+    async def flush(self, bot) -> None:
+        if not self._count or time.monotonic() < self._paused_until:
+            return
+        count, profiles = self._count, self._profiles
+        self._count, self._profiles = 0, []
+        try:
+            await bot.send_message(chat_id=NOTIFICATION_CHANNEL_ID, text=self._render(count, profiles))
+        except RetryAfter as e:
+            logger.warning(f"Yangi foydalanuvchilar xabari: RetryAfter {e.retry_after} s")
+            self._paused_until = time.monotonic() + float(e.retry_after)
+            self._count += count
+            self._profiles = (profiles + self._profiles)[:self.max_profiles]
+        except Exception as e:
+            logger.error(f"Kanalga xabar yuborishda xatolik: {e}")
+
+    # To'xtatishda oxirgi yuborish: RetryAfter pauzasi `timeout` ichida tugasa kutiladi,
+    # baribir yuborilmasa tushib qolgan foydalanuvchilar soni log qilinadi
+    async def close(self, bot, timeout: float) -> None:
+        delay = self._paused_until - time.monotonic()
+        if self._count and 0 < delay <= timeout:
+            await asyncio.sleep(delay)
+        await self.flush(bot)
+        if self._count:
+            logger.warning(f"Yangi foydalanuvchilar xabari yuborilmadi, {self._count} ta foydalanuvchi haqida xabar berilmaydi")
+
+    async def run(self, bot) -> None:
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.flush(bot)
+
+join_notifier = JoinNotifier(JOIN_DIGEST_INTERVAL, JOIN_DIGEST_MAX_EVENTS, JOIN_DIGEST_PROFILES)
+
+# Token bucket: soniyasiga `rate` ta ruxsat, `capacity` gacha to'planadi
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+            else:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # RetryAfter kelganda barcha yuboruvchilarni to'xtatib turadi
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+# Har bir foydalanuvchi uchun yengil token bucket: (tokenlar, oxirgi yangilanish, ogohlantirilganmi).
+# Bucket to'la bo'lguncha bo'sh turgan foydalanuvchi yozuvi yo'qolsa hech narsa o'zgarmaydi,
+# shuning uchun eng uzoq faol bo'lmagan yozuvlar xotira chegarasida bemalol o'chiriladi.
+class FloodLimiter:
+    def __init__(self, limits: dict, max_size: int):
+        self.limits = limits
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    # (ruxsat berildimi, ogohlantirish kerakmi)
+    def check(self, user_id: int, kind: str) -> tuple:
+        rate, burst = self.limits[kind]
+        key = (user_id, kind)
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens, warned = burst, False
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            warned = bucket[2]
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now, False)
+            allowed, warn = True, False
+        else:
+            self._buckets[key] = (tokens, now, True)
+            allowed, warn = False, not warned
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return allowed, warn
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+flood_limiter = FloodLimiter({
+    "message": (FLOOD_MESSAGE_RATE, FLOOD_MESSAGE_BURST),
+    "callback": (FLOOD_CALLBACK_RATE, FLOOD_CALLBACK_BURST),
+}, FLOOD_MAX_USERS)
+
+class BroadcastJob:
+    def __init__(self, job_id: str, text: str, admin_chat_id: int, progress_message_id: int = None,
+                 cursor: int = 0, sent: int = 0, failed: int = 0, total: int = 0, started_at: float = None):
+        self.job_id = job_id
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        self.progress_message_id = progress_message_id
+        self.cursor = cursor
+        self.sent = sent
+        self.failed = failed
+        self.total = total
+        self.started_at = started_at or time.time()
+        self.targets = []
+        self.checkpoint()
+
+    # Faqat to'liq yuborilgan bo'laklar saqlanadi, shunda qayta ishga
+    # tushganda hisoblagichlar kursor bilan mos keladi
+    def checkpoint(self) -> None:
+        self._saved = (self.cursor, self.sent, self.failed)
+
+    @property
+    def targets_file(self) -> str:
+        return f"broadcast_{self.job_id}.json"
+
+    def to_dict(self) -> dict:
+        cursor, sent, failed = self._saved
+        return {
+            "text": self.text,
+            "admin_chat_id": self.admin_chat_id,
+            "progress_message_id": self.progress_message_id,
+            "cursor": cursor,
+            "sent": sent,
+            "failed": failed,
+            "total": self.total,
+            "started_at": self.started_at,
+        }
+
+    def progress_text(self, done: bool = False) -> str:
+        remaining = self.total - self.sent - self.failed
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        processed = self.sent + self.failed
+        eta = int(remaining * elapsed / processed) if processed else 0
+        header = "✅ Broadcast yakunlandi" if done else "📩 Broadcast yuborilmoqda..."
+        return (
+            f"{header}\n"
+            f"Yuborildi: {self.sent}\n"
+            f"Xatolik: {self.failed}\n"
+            f"Qoldi: {remaining}\n"
+            f"Taxminiy vaqt: {eta // 60} daq {eta % 60} s"
+        )
+
+# Broadcastlarni fonda, tezlik cheklovi bilan yuboradi. Holat broadcasts.json ga
+# saqlanadi, bot qayta ishga tushsa yuborish to'xtagan joyidan davom etadi.
+class BroadcastManager:
+    def __init__(self, rate: float, concurrency: int, progress_interval: float):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.jobs = {}
+        self._tasks = {}
+        # Yuborishda aniqlangan o'lik chatlar: registrda darhol nofaol qilinadi,
+        # omborga esa progress_interval da bir marta bitta yozuv bilan tushadi
+        self._inactive = set()
+
+    async def _flush_inactive(self) -> None:
+        if not self._inactive:
+            return
+        user_ids, self._inactive = self._inactive, set()
+        try:
+            await storage.set_users_active(sorted(user_ids), False)
+        except Exception as e:
+            logger.error(f"Nofaol foydalanuvchilar saqlanmadi ({len(user_ids)} ta), keyingi safar yoziladi: {e}")
+            self._inactive |= user_ids
+
+    async def _save_state(self) -> None:
+        await persistence_writer.write_json(
+            BROADCAST_STATE_FILE, {job_id: job.to_dict() for job_id, job in self.jobs.items()}
+        )
+
+    async def start(self, bot, text: str, admin_chat_id: int, targets: list) -> BroadcastJob:
+        job = BroadcastJob(uuid.uuid4().hex[:12], text, admin_chat_id, total=len(targets))
+        job.targets = targets
+        message = await bot.send_message(chat_id=admin_chat_id, text=job.progress_text())
+        job.progress_message_id = message.message_id
+        self.jobs[job.job_id] = job
+        await persistence_writer.write_json(job.targets_file, targets)
+        await self._save_state()
+        self._tasks[job.job_id] = asyncio.create_task(self._run(bot, job))
+        return job
+
+    async def resume(self, bot) -> None:
+        state_path = os.path.join(os.getcwd(), BROADCAST_STATE_FILE)
+        if not os.path.exists(state_path):
+            return
+        for job_id, data in load_json(BROADCAST_STATE_FILE).items():
+            job = BroadcastJob(job_id, **data)
+            job.targets = load_json(job.targets_file)
+            if not job.targets:
+                logger.error(f"Broadcast {job_id} qabul qiluvchilar ro'yxati topilmadi")
+                continue
+            self.jobs[job_id] = job
+            self._tasks[job_id] = asyncio.create_task(self._run(bot, job))
+            logger.info(f"Broadcast {job_id} davom ettirilmoqda: {job.cursor}/{job.total}")
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        await self._flush_inactive()
+        if self.jobs:
+            await self._save_state()
+
+    async def _send(self, bot, job: BroadcastJob, user_id) -> None:
+        while True:
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=job.text)
+                job.sent += 1
+                return
+            except RetryAfter as e:
+                logger.warning(f"Broadcast: RetryAfter {e.retry_after} s")
+                self.bucket.pause(float(e.retry_after))
+            except Exception as e:
+                job.failed += 1
+                if is_dead_chat_error(e):
+                    if user_registry.set_active(int(user_id), False):
+                        self._inactive.add(int(user_id))
+                else:
+                    logger.error(f"Xabar yuborishda xatolik {user_id}: {e}")
+                return
+
+    async def _update_progress(self, bot, job: BroadcastJob, done: bool = False) -> None:
+        try:
+            await bot.edit_message_text(
+                chat_id=job.admin_chat_id, message_id=job.progress_message_id, text=job.progress_text(done)
+            )
+        except Exception as e:
+            logger.error(f"Broadcast holatini yangilashda xatolik: {e}")
+
+    async def _run(self, bot, job: BroadcastJob) -> None:
+        last_report = time.monotonic()
+        while job.cursor < len(job.targets):
+            chunk = job.targets[job.cursor:job.cursor + self.concurrency]
+            await asyncio.gather(*[self._send(bot, job, user_id) for user_id in chunk])
+            # Kursor faqat butun bo'lak yuborilgandan keyin suriladi va har bir bo'lakdan
+            # keyin saqlanadi: qayta ishga tushganda ko'pi bilan bitta bo'lak qayta yuboriladi.
+            # Admin xabari va nofaol foydalanuvchilar BROADCAST_PROGRESS_INTERVAL da bir yoziladi.
+            job.cursor += len(chunk)
+            job.checkpoint()
+            await self._save_state()
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._flush_inactive()
+                await self._update_progress(bot, job)
+
+        await self._flush_inactive()
+        await self._update_progress(bot, job, done=True)
+        del self.jobs[job.job_id]
+        self._tasks.pop(job.job_id, None)
+        await self._save_state()
+        try:
+            os.remove(os.path.join(os.getcwd(), job.targets_file))
+        except OSError:
+            pass
+        logger.info(f"Broadcast {job.job_id} yakunlandi: {job.sent} yuborildi, {job.failed} xatolik")
+
+broadcast_manager = BroadcastManager(BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL)
+
+# Qismlar sahifalash klaviaturalari keshi: (anime, sahifa, tanlangan qism) -> tayyor markup
+PARTS_PER_PAGE = 5
+PARTS_KEYBOARD_CACHE_SIZE = int(os.getenv("PARTS_KEYBOARD_CACHE_SIZE", 10000))
+
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + to_base36(-value)
+    result = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        result = BASE36_DIGITS[remainder] + result
+        if not value:
+            return result
+
+# Callback ma'lumotlari: "<versiya><kod>|arg|arg". Handler kod bo'yicha bitta lug'at
+# qidiruvi bilan topiladi. Argument turlari: "n" - anime raqami (kanonik raqam base36 da),
+# "i" - butun son (base36), "s" - matn. Ma'lumot doim tugmaning o'zida bo'ladi, shuning
+# uchun restart, boshqa jarayon yoki keshdagi eski klaviatura uni baribir o'qiy oladi.
+# 64 baytga sig'ishi anime raqami kiritilayotganda fits_number bilan tekshiriladi.
+class CallbackRouter:
+    VERSION = "1"
+    SEPARATOR = "|"
+    MAX_BYTES = 64
+    # Qism indeksi uchun joy zaxirasi: base36 da 4 belgi
+    MAX_PART_INDEX = 36 ** 4 - 1
+    ESCAPED = re.compile(r"\\(.)")
+
+    def __init__(self, schemas: dict):
+        self.schemas = schemas
+        self.handlers = {}
+
+    def _encode_arg(self, kind: str, value) -> str:
+        if kind == "i":
+            return to_base36(int(value))
+        text = str(value)
+        if kind == "n":
+            if text.isascii() and text.isdigit() and (text == "0" or text[0] != "0"):
+                return to_base36(int(text))
+            # Kanonik bo'lmagan raqamlar (masalan "007") o'zgarishsiz saqlanadi
+            text = "'" + text
+        return text.replace("\\", "\\\\").replace(self.SEPARATOR, "\\!")
+
+    def _decode_arg(self, kind: str, raw: str):
+        if kind == "i":
+            return int(raw, 36)
+        if kind == "n" and not raw.startswith("'"):
+            return str(int(raw, 36))
+        text = self.ESCAPED.sub(lambda match: self.SEPARATOR if match.group(1) == "!" else match.group(1), raw)
+        return text[1:] if kind == "n" else text
+
+    def encode(self, code: str, *args) -> str:
+        kinds = self.schemas[code]
+        data = self.SEPARATOR.join([self.VERSION + code] + [self._encode_arg(kind, arg) for kind, arg in zip(kinds, args)])
+        if len(data.encode("utf-8")) > self.MAX_BYTES:
+            raise ValueError(f"Callback ma'lumoti {self.MAX_BYTES} baytdan uzun: {data!r}")
+        return data
+
+    # Anime raqami eng uzun "n" argumentli tugmaga ham sig'adimi
+    def fits_number(self, number: str) -> bool:
+        longest = self.SEPARATOR.join([self.VERSION + "p", self._encode_arg("n", number), to_base36(self.MAX_PART_INDEX)])
+        return len(longest.encode("utf-8")) <= self.MAX_BYTES
+
+    # (kod, argumentlar); tanilmagan yoki eskirgan ma'lumot uchun (None, ())
+    def decode(self, data: str) -> tuple:
+        if not data.startswith(self.VERSION):
+            return self._decode_legacy(data)
+        code, *raw_args = data[len(self.VERSION):].split(self.SEPARATOR)
+        kinds = self.schemas.get(code)
+        if kinds is None or len(kinds) != len(raw_args):
+            return None, ()
+        try:
+            return code, tuple(self._decode_arg(kind, raw) for kind, raw in zip(kinds, raw_args))
+        except ValueError:
+            return None, ()
+
+    # Versiyasiz eski tugmalar: foydalanuvchilarning eski xabarlaridagi qism/navigatsiya
+    # tugmalari ishlashda davom etadi. Raqam ichidagi "_" ham to'g'ri ajratiladi.
+    @staticmethod
+    def _decode_legacy(data: str) -> tuple:
+        if data == "check_sub":
+            return "cs", ()
+        prefix, _, rest = data.partition("_")
+        number, _, last = rest.rpartition("_")
+        if number and prefix == "part" and last.isdigit():
+            return "p", (number, int(last))
+        if number and prefix == "nav" and last in ("prev", "next"):
+            return "n", (number, -1 if last == "prev" else 1)
+        return None, ()
+
+    # CallbackQueryHandler uchun pattern: kod va berilgan boshlang'ich argumentlar mos kelsa
+    def pattern(self, code: str, *args):
+        def matches(data) -> bool:
+            if not isinstance(data, str):
+                return False
+            decoded, values = self.decode(data)
+            return decoded == code and values[:len(args)] == args
+        return matches
+
+    # Suhbatlarga tegishli bo'lmagan barcha callbacklar uchun yagona handler
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        code, _ = self.decode(query.data or "")
+        handler = self.handlers.get(code)
+        if handler is None:
+            await query.answer()
+            return ConversationHandler.END
+        return await handler(update, context)
+
+callback_router = CallbackRouter({
+    "p": "ni",    # qism tanlash: anime, qism indeksi
+    "n": "ni",    # qismlar sahifasi: anime, +1/-1
+    "cs": "",     # obunani tekshirish
+    "a": "s",     # admin panel amali
+    "cp": "si",   # katalog sahifasi: oqim, sahifa
+    "cx": "",     # katalog sahifa raqami (hech narsa qilmaydi)
+    "dm": "n",    # o'chiriladigan anime
+    "ap": "n",    # yangi qism qo'shiladigan anime
+    "ct": "s",    # kanal turi: public/private
+    "rs": "s",    # o'chiriladigan kanal
+    "ry": "s",    # kanal o'chirishni tasdiqlash
+    "rn": "",     # kanal o'chirishni bekor qilish
+    "ps": "s",    # post yuboriladigan kanal
+    "pt": "s",    # post turi
+})
+
+class PartsKeyboardCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._by_movie = {}
+
+    @staticmethod
+    def total_pages(number: str) -> int:
+        return (len(movies_data[number]["part_data"]) + PARTS_PER_PAGE - 1) // PARTS_PER_PAGE
+
+    def get(self, number: str, page: int, selected: int):
+        # Tanlangan qism boshqa sahifada bo'lsa klaviaturaga ta'sir qilmaydi: kalitga kirmaydi
+        if selected is not None and not page * PARTS_PER_PAGE <= selected < (page + 1) * PARTS_PER_PAGE:
+            selected = None
+        key = (number, page, selected)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        markup = self._build(number, page, selected)
+        self._entries[key] = markup
+        self._by_movie.setdefault(number, set()).add(key)
+        while len(self._entries) > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            self._by_movie[old_key[0]].discard(old_key)
+        return markup
+
+    def _build(self, number: str, page: int, selected: int):
+        # Cheklov kiritilishidan oldin qo'shilgan uzun raqamlar tugmaga sig'maydi: video
+        # klaviaturasiz yuboriladi (load_data ularni ogohlantirish bilan log qiladi)
+        if not callback_router.fits_number(number):
+            return None
+        parts = movies_data[number]["part_data"]
+        start_idx = page * PARTS_PER_PAGE
+        keyboard = [
+            [InlineKeyboardButton(f"{part['part_name']}", callback_data=callback_router.encode("p", number, i))]
+            for i, part in enumerate(parts[start_idx:start_idx + PARTS_PER_PAGE], start=start_idx)
+            if i != selected
+        ]
+        nav_row = []
+        if page > 0:
+            nav_row.append(InlineKeyboardButton("⬅️", callback_data=callback_router.encode("n", number, -1)))
+        if page < self.total_pages(number) - 1:
+            nav_row.append(InlineKeyboardButton("➡️", callback_data=callback_router.encode("n", number, 1)))
+        if nav_row:
+            keyboard.append(nav_row)
+        return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    def invalidate(self, number: str) -> None:
+        for key in self._by_movie.pop(number, ()):
+            self._entries.pop(key, None)
+
+parts_keyboards = PartsKeyboardCache(PARTS_KEYBOARD_CACHE_SIZE)
+
+# Admin katalog brauzeri uchun tartiblangan indeks. Anime qo'shilganda yoki
+# o'chirilganda qisman yangilanadi, sahifalar movies_data ni skanerlamasdan olinadi.
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 10))
+
+def _catalog_sort_key(number: str) -> tuple:
+    return (0, int(number), number) if number.isdigit() else (1, 0, number)
+
+class CatalogIndex:
+    # "all" - barcha animelar, "parts" - faqat qismli animelar
+    KINDS = ("all", "parts")
+
+    def __init__(self):
+        self._numbers = {kind: [] for kind in self.KINDS}
+        self._titles = {kind: [] for kind in self.KINDS}
+        self._entries = {}
+
+    def _kinds(self, movie: dict) -> tuple:
+        return self.KINDS if "part_data" in movie else ("all",)
+
+    def rebuild(self, movies: dict) -> None:
+        self._numbers = {kind: [] for kind in self.KINDS}
+        self._titles = {kind: [] for kind in self.KINDS}
+        self._entries = {}
+        for number, movie in movies.items():
+            key = _catalog_sort_key(number)
+            title_key = (movie["title"].casefold(), key)
+            self._entries[number] = (key, title_key, self._kinds(movie))
+            for kind in self._kinds(movie):
+                self._numbers[kind].append(key)
+                self._titles[kind].append(title_key)
+        for kind in self.KINDS:
+            self._numbers[kind].sort()
+            self._titles[kind].sort()
+
+    def add(self, number: str, movie: dict) -> None:
+        self.remove(number)
+        key = _catalog_sort_key(number)
+        title_key = (movie["title"].casefold(), key)
+        kinds = self._kinds(movie)
+        self._entries[number] = (key, title_key, kinds)
+        for kind in kinds:
+            bisect.insort(self._numbers[kind], key)
+            bisect.insort(self._titles[kind], title_key)
+
+    def remove(self, number: str) -> None:
+        entry = self._entries.pop(number, None)
+        if entry is None:
+            return
+        key, title_key, kinds = entry
+        for kind in kinds:
+            numbers = self._numbers[kind]
+            del numbers[bisect.bisect_left(numbers, key)]
+            titles = self._titles[kind]
+            del titles[bisect.bisect_left(titles, title_key)]
+
+    # (sahifadagi raqamlar, jami sahifalar soni). prefix berilsa nom boshi bo'yicha filtrlanadi
+    def page(self, kind: str, page: int, prefix: str = None) -> tuple:
+        if prefix:
+            titles = self._titles[kind]
+            prefix = prefix.casefold()
+            lo = bisect.bisect_left(titles, (prefix,))
+            hi = bisect.bisect_left(titles, (prefix + "\U0010ffff",))
+            total = hi - lo
+            pages = max(1, (total + CATALOG_PAGE_SIZE - 1) // CATALOG_PAGE_SIZE)
+            page = min(max(page, 0), pages - 1)
+            start = lo + page * CATALOG_PAGE_SIZE
+            return [title_key[1][2] for title_key in titles[start:min(start + CATALOG_PAGE_SIZE, hi)]], pages, page
+        numbers = self._numbers[kind]
+        pages = max(1, (len(numbers) + CATALOG_PAGE_SIZE - 1) // CATALOG_PAGE_SIZE)
+        page = min(max(page, 0), pages - 1)
+        start = page * CATALOG_PAGE_SIZE
+        return [key[2] for key in numbers[start:start + CATALOG_PAGE_SIZE]], pages, page
+
+catalog_index = CatalogIndex()
+
+# Inline qidiruv: anime nomlari bo'yicha trigram indeks
+INLINE_RESULTS_LIMIT = 50
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", 5000))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+
+def _search_tokens(text: str) -> list:
+    return "".join(ch if ch.isalnum() else " " for ch in text.casefold()).split()
+
+def _token_keys(token: str) -> set:
+    # So'z boshidagi 1-2 harf qisqa so'rovlar uchun, trigramlar uzunroq so'rovlar uchun
+    keys = {"^" + token[:1], "^" + token[:2]}
+    padded = " " + token
+    keys.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return keys
+
+class TitleSearchIndex:
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self._postings = {}
+        self._titles = {}
+        self._cache = OrderedDict()
+
+    def rebuild(self, movies: dict) -> None:
+        self._postings = {}
+        self._titles = {}
+        self._cache.clear()
+        for number, movie in movies.items():
+            self._index(number, movie["title"])
+
+    def _index(self, number: str, title: str) -> None:
+        tokens = _search_tokens(title)
+        self._titles[number] = (" ".join(tokens), tokens, _catalog_sort_key(number))
+        for token in tokens:
+            for key in _token_keys(token):
+                self._postings.setdefault(key, set()).add(number)
+
+    def add(self, number: str, title: str) -> None:
+        self.remove(number)
+        self._index(number, title)
+        self._cache.clear()
+
+    def remove(self, number: str) -> None:
+        entry = self._titles.pop(number, None)
+        if entry is None:
+            return
+        for token in entry[1]:
+            for key in _token_keys(token):
+                postings = self._postings.get(key)
+                if postings is not None:
+                    postings.discard(number)
+                    if not postings:
+                        del self._postings[key]
+        self._cache.clear()
+
+    def _candidates(self, token: str) -> set:
+        if len(token) < 3:
+            return self._postings.get("^" + token, set())
+        padded = " " + token
+        sets = [self._postings.get(padded[i:i + 3], set()) for i in range(len(padded) - 2)]
+        sets.sort(key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            result &= other
+            if not result:
+                break
+        return result
+
+    def search(self, query: str) -> list:
+        tokens = _search_tokens(query)
+        if not tokens:
+            return []
+        cache_key = " ".join(tokens)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+        candidate_sets = sorted((self._candidates(token) for token in tokens), key=len)
+        candidates = set(candidate_sets[0])
+        for other in candidate_sets[1:]:
+            candidates &= other
+        # Trigramlar mos kelgani so'z mos kelganini kafolatlamaydi - uzun so'zlar tekshiriladi.
+        # Qisqa so'zlar "^" prefiks kalitlaridan olinadi va ular aniq.
+        long_tokens = [token for token in tokens if len(token) >= 3]
+        matches = []
+        for number in candidates:
+            title, title_tokens, sort_key = self._titles[number]
+            if long_tokens and not all(any(token in word for word in title_tokens) for token in long_tokens):
+                continue
+            matches.append((not title.startswith(cache_key), sort_key))
+        matches.sort()
+        result = [sort_key[2] for _, sort_key in matches]
+        self._cache[cache_key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+search_index = TitleSearchIndex(INLINE_CACHE_SIZE)
+
+# Anime yoki qism yozuvi: (yozuv, URL kaliti). part_index=None - oddiy anime
+def video_entry(number: str, part_index=None):
+    video_info = movies_data[number]
+    if part_index is None:
+        return video_info, "video_url"
+    return video_info["part_data"][part_index], "part_url"
+
+# So'rov yo'lida omborni kutmaydi: yozuvni file_id_buffer bajaradi
+def remember_file_id(number: str, part_index, entry: dict, file_id) -> None:
+    if entry.get("file_id") == file_id:
+        return
+    if file_id:
+        entry["file_id"] = file_id
+    else:
+        entry.pop("file_id", None)
+    file_id_buffer.add(number, part_index)
+
+# Videoni saqlangan file_id orqali yuboradi, Telegram uni qayta yuklab o'tirmaydi.
+# file_id rad etilsa asl URL ishlatiladi va yangi file_id saqlanadi.
+async def send_catalog_video(send, number: str, part_index=None, **kwargs):
+    entry, url_key = video_entry(number, part_index)
+    file_id = entry.get("file_id")
+    if file_id:
+        try:
+            return await send(video=file_id, **kwargs)
+        except BadRequest as e:
+            logger.error(f"file_id rad etildi ({number}, {part_index}): {e}")
+            remember_file_id(number, part_index, entry, None)
+    message = await send(video=entry[url_key], **kwargs)
+    if message.video:
+        remember_file_id(number, part_index, entry, message.video.file_id)
+    return message
+
+# Katalogdagi file_id si yo'q videolarni oldindan yuborib, file_id larni to'playdi
+async def warm_up_file_ids(bot, chat_id, rate: float) -> None:
+    bucket = TokenBucket(rate, 1)
+    resolved = 0
+    for number in list(movies_data.keys()):
+        video_info = movies_data.get(number)
+        if not video_info:
+            continue
+        indexes = range(len(video_info["part_data"])) if "part_data" in video_info else [None]
+        for part_index in indexes:
+            try:
+                entry, url_key = video_entry(number, part_index)
+            except (KeyError, IndexError):
+                break
+            if entry.get("file_id") or not entry.get(url_key):
+                continue
+            while True:
+                await bucket.acquire()
+                try:
+                    message = await bot.send_video(chat_id=chat_id, video=entry[url_key], disable_notification=True)
+                    break
+                except RetryAfter as e:
+                    bucket.pause(float(e.retry_after))
+                except Exception as e:
+                    logger.error(f"file_id isitishda xatolik ({number}, {part_index}): {e}")
+                    message = None
+                    break
+            if message is None:
+                continue
+            if message.video:
+                remember_file_id(number, part_index, entry, message.video.file_id)
+                resolved += 1
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+            except Exception as e:
+                logger.error(f"Isitish xabarini o'chirishda xatolik: {e}")
+    logger.info(f"file_id isitish yakunlandi: {resolved} ta video")
 
 # ConversationHandler holatlari
 MOVIE_TITLE, MOVIE_PARTS, MOVIE_PART_URL, MOVIE_NUMBER = range(4)
@@ -80,13 +2157,289 @@ ADD_CHANNEL_TYPE, ADD_CHANNEL_ID = range(10, 12)
 ADD_NEW_PART_SELECT, ADD_NEW_PART_NAME, ADD_NEW_PART_URL = range(17, 20)
 POST_TO_CHANNEL, POST_TYPE, POST_TEXT, POST_MEDIA, POST_BUTTON_TEXT, POST_BUTTON_URL = range(20, 26)
 
+# Obuna natijalari keshi: (user_id, channel) -> (natija, tugash vaqti)
+class SubscriptionCache:
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, user_id: int, channel):
+        key = (user_id, channel)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, user_id: int, channel, subscribed: bool) -> None:
+        ttl = self.ttl if subscribed else self.negative_ttl
+        if ttl <= 0:
+            return
+        key = (user_id, channel)
+        self._entries[key] = (subscribed, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for channel in CHANNELS:
+            self._entries.pop((user_id, channel), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+subscription_cache = SubscriptionCache(SUB_CACHE_TTL, SUB_CACHE_NEGATIVE_TTL, SUB_CACHE_MAX_SIZE)
+
+SUBSCRIBED_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# Kanal a'zoligi indeksi: kanal -> (a'zolar, chiqib ketganlar) to'plamlari. Kanal indeksga
+# undan birinchi chat_member yangilanishi kelganda qo'shiladi (ya'ni bot u yerda admin va
+# o'zgarishlarni oladi). Shundan keyin obuna shu indeksdan tekshiriladi; indeks hali
+# ko'rmagan foydalanuvchi uchungina getChatMember chaqiriladi va natija indeksga yoziladi.
+class MembershipIndex:
+    def __init__(self, flush_interval: float, reconcile_interval: float, reconcile_sample: int):
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_sample = reconcile_sample
+        self.hits = 0
+        self.misses = 0
+        self._channels = {}
+        self._dirty = {}
+        self._dropped = set()
+
+    def load(self, rows, channels) -> None:
+        known = {str(channel) for channel in channels}
+        for channel, user_id, member in rows:
+            if channel in known:
+                self._sets(channel)[0 if member else 1].add(user_id)
+            else:
+                self._dropped.add(channel)
+
+    def _sets(self, channel: str) -> tuple:
+        sets = self._channels.get(channel)
+        if sets is None:
+            sets = self._channels[channel] = (set(), set())
+        return sets
+
+    def __len__(self) -> int:
+        return sum(len(members) + len(left) for members, left in self._channels.values())
+
+    # True/False - indeksdagi holat, None - kanal kuzatilmaydi yoki foydalanuvchi noma'lum
+    def get(self, user_id: int, channel):
+        sets = self._channels.get(str(channel))
+        if sets is not None:
+            if user_id in sets[0]:
+                self.hits += 1
+                return True
+            if user_id in sets[1]:
+                self.hits += 1
+                return False
+        self.misses += 1
+        return None
+
+    # track=True faqat chat_member yangilanishi uchun: kanal shundan keyin kuzatiladi.
+    # Boshqa manbalar (getChatMember, boshqa jarayonlar) faqat kuzatilayotgan kanalni yangilaydi.
+    def set(self, user_id: int, channel, member: bool, track: bool = False, persist: bool = True) -> bool:
+        channel = str(channel)
+        if not track and channel not in self._channels:
+            return False
+        members, left = self._sets(channel)
+        if user_id in (members if member else left):
+            return False
+        (members if member else left).add(user_id)
+        (left if member else members).discard(user_id)
+        if persist:
+            self._dirty[(channel, user_id)] = member
+        return True
+
+    # "Tekshirish" bosilganda obuna bo'lmagan deb yozilgan kanallar qayta so'raladi
+    def forget_missing(self, user_id: int, channels) -> None:
+        for channel in channels:
+            sets = self._channels.get(str(channel))
+            if sets is not None:
+                sets[1].discard(user_id)
+
+    # Ro'yxatdan chiqarilgan kanallar indeksi o'chiriladi
+    def retain(self, channels) -> None:
+        known = {str(channel) for channel in channels}
+        for channel in list(self._channels):
+            if channel not in known:
+                del self._channels[channel]
+                self._dropped.add(channel)
+        self._dirty = {key: member for key, member in self._dirty.items() if key[0] in known}
+
+    # Yozish oqimi uchun nusxa: {kanal: (a'zolar, chiqib ketganlar)} to'plamlari
+    def dump(self) -> dict:
+        return {channel: (set(members), set(left)) for channel, (members, left) in self._channels.items()}
+
+    async def flush(self) -> None:
+        if not self._dirty and not self._dropped:
+            return
+        changes, dropped = self._dirty, self._dropped
+        self._dirty, self._dropped = {}, set()
+        try:
+            await storage.save_memberships(changes, dropped)
+        except Exception as e:
+            logger.error(f"A'zolik indeksini saqlashda xatolik: {e}")
+            for key, member in changes.items():
+                self._dirty.setdefault(key, member)
+            self._dropped |= dropped
+
+    # Har bir kanaldan tasodifiy yozuvlarni getChatMember bilan solishtirib, farqlarni tuzatadi
+    async def reconcile(self, bot) -> None:
+        for channel, (members, left) in list(self._channels.items()):
+            entries = [(user_id, True) for user_id in members] + [(user_id, False) for user_id in left]
+            sample = random.sample(entries, min(self.reconcile_sample, len(entries)))
+            checked = drift = 0
+            for user_id, expected in sample:
+                try:
+                    chat_member = await bot.get_chat_member(chat_id=channel, user_id=user_id)
+                except Exception as e:
+                    logger.warning(f"A'zolikni solishtirishda xatolik ({channel}, {user_id}): {e}")
+                    continue
+                checked += 1
+                actual = chat_member.status in SUBSCRIBED_STATUSES
+                if actual != expected and self.set(user_id, channel, actual):
+                    drift += 1
+            MEMBERSHIP_CHECKED.inc(channel, amount=checked)
+            MEMBERSHIP_DRIFT.inc(channel, amount=drift)
+            if drift:
+                logger.warning(f"A'zolik indeksida farq: {channel} kanalida {drift}/{checked} ta yozuv tuzatildi")
+
+    async def run(self, bot) -> None:
+        last_reconcile = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if IS_PRIMARY and time.monotonic() - last_reconcile >= self.reconcile_interval:
+                last_reconcile = time.monotonic()
+                try:
+                    await self.reconcile(bot)
+                except Exception as e:
+                    logger.error(f"A'zolik indeksini solishtirishda xatolik: {e}")
+
+membership_index = MembershipIndex(MEMBERSHIP_FLUSH_INTERVAL, MEMBERSHIP_RECONCILE_INTERVAL, MEMBERSHIP_RECONCILE_SAMPLE)
+
+# Ombordagi ma'lumotlarni va ular asosidagi indekslarni yuklaydi. Ishchi jarayon main() boshida
+# chaqiradi; nazoratchi jarayon chaqirmaydi.
+def load_data() -> None:
+    global storage, movies_data, CHANNELS, user_registry
+    storage = SqliteStorage(SQLITE_PATH) if STORAGE_BACKEND == "sqlite" else JsonStorage()
+    movies_data = storage.load_movies()
+    CHANNELS = storage.load_channels()
+    user_registry = storage.load_users()
+    startup_timer.mark("ma'lumotlar")
+    long_numbers = [number for number in movies_data if not callback_router.fits_number(number)]
+    if long_numbers:
+        logger.warning(f"{len(long_numbers)} ta anime raqami callback tugmasiga sig'maydi, ularning qism va "
+                       f"katalog tugmalari ko'rsatilmaydi: {', '.join(long_numbers[:10])}")
+    catalog_index.rebuild(movies_data)
+    search_index.rebuild(movies_data)
+    startup_timer.mark("indekslar")
+    membership_index.load(storage.load_memberships(), CHANNELS)
+
 async def is_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE, channel) -> bool:
+    known = membership_index.get(user_id, channel)
+    if known is not None:
+        return known
+    cached = subscription_cache.get(user_id, channel)
+    if cached is not None:
+        return cached
     try:
         chat_member = await context.bot.get_chat_member(chat_id=channel, user_id=user_id)
-        return chat_member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        subscribed = chat_member.status in SUBSCRIBED_STATUSES
     except Exception as e:
+        # Xatolik natijasi keshlanmaydi, keyingi safar qayta so'raladi
         logger.error(f"Obunani tekshirishda xatolik: {e}")
         return False
+    membership_index.set(user_id, channel, subscribed)
+    subscription_cache.set(user_id, channel, subscribed)
+    return subscribed
+
+async def _check_channel(user_id: int, context: ContextTypes.DEFAULT_TYPE, channel):
+    try:
+        return channel, await asyncio.wait_for(is_subscribed(user_id, context, channel), SUB_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Obunani tekshirish vaqti tugadi: {channel}")
+        return channel, False
+
+# Foydalanuvchi obuna bo'lmagan kanallar ro'yxati (bo'sh ro'yxat - hammasiga obuna).
+# Kanallar parallel tekshiriladi; short_circuit=True bo'lsa, birinchi obuna
+# bo'lmagan kanal topilishi bilan qolgan so'rovlar bekor qilinadi.
+async def get_missing_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE, short_circuit: bool = True) -> list:
+    channels = list(CHANNELS)
+    if not channels:
+        return []
+    pending = {asyncio.ensure_future(_check_channel(user_id, context, channel)) for channel in channels}
+    missing = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                channel, subscribed = task.result()
+                if not subscribed:
+                    missing.append(channel)
+            if missing and short_circuit:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    return sorted(missing, key=channels.index)
+
+# Bot admin bo'lgan kanalda kimdir qo'shilsa yoki chiqsa, Telegram chat_member yuboradi
+async def track_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat = update.chat_member.chat
+    username = (chat.username or "").lower()
+    channel = next((channel for channel in CHANNELS if channel == chat.id
+                    or (isinstance(channel, str) and username and channel[1:].lower() == username)), None)
+    if channel is None:
+        return
+    new_member = update.chat_member.new_chat_member
+    membership_index.set(new_member.user.id, channel, new_member.status in SUBSCRIBED_STATUSES, track=True)
+    subscription_cache.invalidate_user(new_member.user.id)
+
+# Barcha handlerlardan oldin (-1 guruh) ishlaydi. Limitdan oshgan yangilanish boshqa
+# handlerlarga yetib bormaydi; foydalanuvchi har bir cheklov davrida faqat bir marta ogohlantiriladi.
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = update.effective_user
+    if user is None or user.id in ADMIN_IDS:
+        return
+    if update.callback_query:
+        kind = "callback"
+    elif update.message:
+        kind = "message"
+    else:
+        return
+    allowed, warn = flood_limiter.check(user.id, kind)
+    if allowed:
+        return
+    FLOOD_DROPPED.inc(kind)
+    if warn:
+        try:
+            if kind == "callback":
+                await update.callback_query.answer("Juda tez! Biroz kuting.")
+            else:
+                await update.message.reply_text("Juda ko'p so'rov yubordingiz. Biroz kuting.")
+        except Exception as e:
+            logger.warning(f"Flood ogohlantirishini yuborishda xatolik: {e}")
+    raise ApplicationHandlerStop
 
 async def get_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message and update.message.chat.type in ["channel", "supergroup"]:
@@ -101,76 +2454,61 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     first_name = update.message.from_user.first_name or "Noma'lum"
     profile_url = f"https://t.me/{username}" if username != "Noma'lum" else f"tg://user?id={user_id}"
 
-    if str(user_id) not in users_data:
-        users_data[str(user_id)] = {
-            "username": username,
-            "first_name": first_name,
-            "joined_date": str(update.message.date)
-        }
-        save_json("users.json", users_data)
-        
-        try:
-            await context.bot.send_message(
-                chat_id=NOTIFICATION_CHANNEL_ID,
-                text=f"Yangi foydalanuvchi:\nIsm: {first_name}\nUsername: @{username}\nProfil: {profile_url}"
-            )
-        except Exception as e:
-            logger.error(f"Kanalga xabar yuborishda xatolik: {e}")
+    if user_id not in user_registry:
+        user_registry.add(user_id, username, first_name, update.message.date.timestamp())
+        await storage.add_user(str(user_id), user_registry.get(user_id))
+        join_notifier.add(first_name, username, profile_url)
+    elif not user_registry.is_active(user_id):
+        # Botni bloklab, keyin qayta /start bosgan foydalanuvchi yana faol
+        await set_user_active(user_id, True)
 
     if user_id in ADMIN_IDS:
-        keyboard = [
-            [InlineKeyboardButton("🎮 Qismli Anime qo‘shish", callback_data="add_movie_parts")],
-            [InlineKeyboardButton("🎬 Oddiy Anime qo‘shish", callback_data="add_simple_movie")],
-            [InlineKeyboardButton("📢 Kanal qo‘shish", callback_data="add_channel")],
-            [InlineKeyboardButton("❌ Kanalni o'chirish", callback_data="remove_channel")],
-            [InlineKeyboardButton("🗑 Animeni o'chirish", callback_data="delete_movie")],
-            [InlineKeyboardButton("➕ Yangi qism qo‘shish", callback_data="add_new_part")],
-            [InlineKeyboardButton("📤 Kanalga post yuborish", callback_data="post_to_channel")],
-            [InlineKeyboardButton("👥 Foydalanuvchilar soni", callback_data="user_count")],
-            [InlineKeyboardButton("📩 Broadcast", callback_data="broadcast")],
-            [InlineKeyboardButton("🔄 Botni qayta ishga tushirish", callback_data="restart_bot")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Admin paneliga xush kelibsiz!", reply_markup=reply_markup)
+        await update.message.reply_text("Admin paneliga xush kelibsiz!", reply_markup=admin_keyboard())
         return
 
-    is_all_subscribed = all([await is_subscribed(user_id, context, channel) for channel in CHANNELS])
-    if is_all_subscribed:
+    missing_channels = await get_missing_channels(user_id, context, short_circuit=False)
+    if not missing_channels:
         await update.message.reply_text("Xush kelibsiz! Anime raqamini yuboring.")
     else:
-        keyboard = [[InlineKeyboardButton(f"{i+1}-kanal", url=f"https://t.me/{channel[1:]}" if channel.startswith("@") else f"https://t.me/+{channel}")]
-                   for i, channel in enumerate(CHANNELS)]
-        keyboard.append([InlineKeyboardButton("✅ Tekshirish", callback_data="check_sub")])
+        keyboard = [[InlineKeyboardButton(f"{i+1}-kanal", url=f"https://t.me/{channel[1:]}" if str(channel).startswith("@") else f"https://t.me/+{channel}")]
+                   for i, channel in enumerate(missing_channels)]
+        keyboard.append([InlineKeyboardButton("✅ Tekshirish", callback_data=callback_router.encode("cs"))])
         await update.message.reply_text("Botdan foydalanish uchun kanallarga obuna bo‘ling:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    is_all_subscribed = all([await is_subscribed(user_id, context, channel) for channel in CHANNELS])
+    subscription_cache.invalidate_user(user_id)
+    membership_index.forget_missing(user_id, CHANNELS)
+    is_all_subscribed = not await get_missing_channels(user_id, context)
     await query.edit_message_text("✅ Barcha kanallarga obunasiz!" if is_all_subscribed else "❌ Iltimos, barcha kanallarga obuna bo‘ling.")
 
 async def send_user_count(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()
-    await query.edit_message_text(f"Foydalanuvchilar soni: {len(users_data)}")
+    stats = subscription_cache.stats()
+    writer_stats = persistence_writer.stats()
+    await query.edit_message_text(
+        f"Foydalanuvchilar soni: {len(user_registry)} (faol: {user_registry.active_count})\n"
+        f"Obuna keshi: {stats['hits']} hit / {stats['misses']} miss ({stats['hit_rate']:.0%}), hajmi: {stats['size']}\n"
+        f"A'zolik indeksi: {len(membership_index)} ta yozuv, {membership_index.hits} hit / {membership_index.misses} miss\n"
+        f"Yozuv navbati: {writer_stats['queue_depth']}, o'rtacha yozish: {writer_stats['avg_write_ms']:.1f} ms"
+    )
 
 async def add_new_part(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
     if not movies_data:
         await query.edit_message_text("Anime mavjud emas!")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(f"{number}: {data['title']}", callback_data=f"add_part_{number}")]
-                for number, data in movies_data.items() if "part_data" in data]
-    await query.edit_message_text("Yangi qism qo‘shish uchun animeni tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data["catalog_prefix"] = None
+    await show_catalog_page(query.edit_message_text, context, "addpart", 0)
     return ADD_NEW_PART_SELECT
 
 async def select_movie_for_new_part(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    movie_number = query.data.replace("add_part_", "")
+    _, (movie_number,) = callback_router.decode(query.data)
     if movie_number not in movies_data or "part_data" not in movies_data[movie_number]:
         await query.edit_message_text("Anime topilmadi!")
         return ConversationHandler.END
@@ -189,43 +2527,50 @@ async def add_new_part_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     movie_number = context.user_data["movie_to_add_part"]
     part_name = context.user_data["new_part_name"]
 
-    movies_data[movie_number]["part_data"].append({
+    part = {
         "part_name": part_name,
         "part_url": part_url,
-    })
-    save_json("movies.json", movies_data)
+    }
+    movies_data[movie_number]["part_data"].append(part)
+    parts_keyboards.invalidate(movie_number)
+    await storage.add_part(movie_number, len(movies_data[movie_number]["part_data"]) - 1, part)
     await update.message.reply_text(f"✅ Yangi qism qo‘shildi: {part_name}")
     return ConversationHandler.END
 
+# Admin tugmalari uchun yagona kirish nuqtasi: admin bir marta tekshiriladi va faqat
+# tanlangan amal chaqiriladi. Callback javobi amal bilan parallel yuboriladi.
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
-    handlers = {
-        "add_movie_parts": (MOVIE_TITLE, "Qismli anime nomini kiriting:"),
-        "add_simple_movie": (SIMPLE_MOVIE_TITLE, "Oddiy anime nomini kiriting:"),
-        "add_channel": (await add_channel(update, context), None),
-        "remove_channel": (await remove_channel(update, context), None),
-        "delete_movie": (await delete_movie(update, context), None),
-        "broadcast": (await broadcast(update, context), None),
-        "post_to_channel": (await post_to_channel(update, context), None),
-        "restart_bot": (await restart_bot(update, context), None)
-    }
-    
-    if query.data in handlers:
-        state, message = handlers[query.data]
-        if message:
-            await query.message.reply_text(message)
-        return state
-    return ConversationHandler.END
+    code, args = callback_router.decode(query.data)
+    action = ADMIN_ACTIONS.get(args[0]) if code == "a" else None
+    if action is None:
+        await query.answer()
+        return ConversationHandler.END
+    if query.from_user.id not in ADMIN_IDS:
+        await query.answer("Siz admin emassiz!", show_alert=True)
+        return ConversationHandler.END
+    _, state = await asyncio.gather(query.answer(), action[1](update, context))
+    return ConversationHandler.END if state is None else state
+
+async def ask_parts_movie_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.message.reply_text("Qismli anime nomini kiriting:")
+    return MOVIE_TITLE
+
+async def ask_simple_movie_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.message.reply_text("Oddiy anime nomini kiriting:")
+    return SIMPLE_MOVIE_TITLE
 
 async def restart_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()
-    if query.from_user.id not in ADMIN_IDS:
-        await query.edit_message_text("Siz admin emassiz!")
-        return
     await query.edit_message_text("Bot qayta ishga tushirilmoqda...")
-    os._exit(0)
+    if BOT_WORKERS > 1:
+        # Barcha ishchilarni nazoratchi birma-bir qayta ishga tushiradi
+        os.kill(os.getppid(), signal.SIGHUP)
+        return
+    # To'xtatish main() da bajariladi: navbat tugatiladi, ma'lumotlar saqlanadi
+    global restart_requested
+    restart_requested = True
+    stop_event.set()
 
 async def movie_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["movie_title"] = update.message.text
@@ -263,6 +2608,9 @@ async def movie_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     if number in movies_data:
         await update.message.reply_text("Bu raqam allaqachon ishlatilgan! Boshqa raqam kiriting:")
         return MOVIE_NUMBER
+    if not callback_router.fits_number(number):
+        await update.message.reply_text("Raqam juda uzun! Qisqaroq raqam kiriting:")
+        return MOVIE_NUMBER
 
     movies_data[number] = {
         "title": context.user_data["movie_title"],
@@ -270,7 +2618,9 @@ async def movie_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         "part_data": context.user_data["movie_part_data"],
         "views": 0,
     }
-    save_json("movies.json", movies_data)
+    catalog_index.add(number, movies_data[number])
+    search_index.add(number, movies_data[number]["title"])
+    await storage.save_movie(number, movies_data[number])
     await update.message.reply_text(f"✅ Qismli Anime qo‘shildi: {context.user_data['movie_title']}")
     return ConversationHandler.END
 
@@ -289,35 +2639,108 @@ async def simple_movie_number(update: Update, context: ContextTypes.DEFAULT_TYPE
     if number in movies_data:
         await update.message.reply_text("Bu raqam allaqachon ishlatilgan! Boshqa raqam kiriting:")
         return SIMPLE_MOVIE_NUMBER
+    if not callback_router.fits_number(number):
+        await update.message.reply_text("Raqam juda uzun! Qisqaroq raqam kiriting:")
+        return SIMPLE_MOVIE_NUMBER
 
     movies_data[number] = {
         "title": context.user_data["movie_title"],
         "video_url": context.user_data["movie_url"],
         "views": 0,
     }
-    save_json("movies.json", movies_data)
+    catalog_index.add(number, movies_data[number])
+    search_index.add(number, movies_data[number]["title"])
+    await storage.save_movie(number, movies_data[number])
     await update.message.reply_text(f"✅ Oddiy Anime qo‘shildi: {context.user_data['movie_title']}")
     return ConversationHandler.END
 
 async def delete_movie(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
     if not movies_data:
         await query.edit_message_text("O'chirish uchun anime mavjud emas!")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(f"{number}: {data['title']}", callback_data=f"delete_{number}")]
-                for number, data in movies_data.items()]
-    await query.edit_message_text("O'chirish uchun animeni tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data["catalog_prefix"] = None
+    await show_catalog_page(query.edit_message_text, context, "delete", 0)
     return DELETE_MOVIE
 
+# Katalog brauzeri: oqim -> (indeks turi, tanlash callback kodi, sarlavha, holat)
+CATALOG_FLOWS = {
+    "delete": ("all", "dm", "O'chirish uchun animeni tanlang:", DELETE_MOVIE),
+    "addpart": ("parts", "ap", "Yangi qism qo‘shish uchun animeni tanlang:", ADD_NEW_PART_SELECT),
+}
+
+async def show_catalog_page(send, context: ContextTypes.DEFAULT_TYPE, flow: str, page: int) -> None:
+    kind, select_code, title, _ = CATALOG_FLOWS[flow]
+    prefix = context.user_data.get("catalog_prefix")
+    numbers, pages, page = catalog_index.page(kind, page, prefix)
+    # Tugmaga sig'maydigan eski uzun raqamlar ko'rsatiladi, lekin tanlab bo'lmaydi
+    keyboard = [[InlineKeyboardButton(f"{number}: {movies_data[number]['title']}", callback_data=callback_router.encode(select_code, number))]
+                if callback_router.fits_number(number) else
+                [InlineKeyboardButton(f"⚠️ {number}: {movies_data[number]['title']}", callback_data=callback_router.encode("cx"))]
+                for number in numbers]
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton("⬅️", callback_data=callback_router.encode("cp", flow, page - 1)))
+    nav_row.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=callback_router.encode("cx")))
+    if page < pages - 1:
+        nav_row.append(InlineKeyboardButton("➡️", callback_data=callback_router.encode("cp", flow, page + 1)))
+    keyboard.append(nav_row)
+    text = (
+        f"{title}\n"
+        + (f"Filtr: «{prefix}»\n" if prefix else "")
+        + ("Hech narsa topilmadi.\n" if not numbers else "")
+        + "Nom boshini yozing - filtrlash, #N - N-sahifaga o'tish, «-» - filtrni olib tashlash, /cancel - bekor qilish."
+    )
+    context.user_data["catalog_flow"] = flow
+    context.user_data["catalog_page"] = page
+    await send(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+# Har bir oqim o'z sahifalash va qidiruv handlerlariga ega: ular doim o'z suhbatining
+# holatini qaytaradi, user_data dagi oxirgi ochilgan oqimga qaramaydi
+def catalog_handlers(flow: str) -> tuple:
+    state = CATALOG_FLOWS[flow][3]
+
+    async def catalog_navigate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        query = update.callback_query
+        await query.answer()
+        code, args = callback_router.decode(query.data)
+        if code == "cp" and args[0] == flow:
+            await show_catalog_page(query.edit_message_text, context, flow, args[1])
+        return state
+
+    async def catalog_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        text = update.message.text.strip()
+        page = 0
+        if text == "-":
+            context.user_data["catalog_prefix"] = None
+        elif text.startswith("#") and text[1:].isdigit():
+            page = int(text[1:]) - 1
+        else:
+            context.user_data["catalog_prefix"] = text
+        await show_catalog_page(update.message.reply_text, context, flow, page)
+        return state
+
+    catalog_navigate.__name__ = f"catalog_navigate_{flow}"
+    catalog_search.__name__ = f"catalog_search_{flow}"
+    return catalog_navigate, catalog_search
+
+# /cancel: admin suhbatini tugatadi, aks holda tashlab ketilgan holat keyingi matnni egallaydi
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    context.user_data.pop("catalog_prefix", None)
+    await update.message.reply_text("Bekor qilindi.")
+    return ConversationHandler.END
+
 async def confirm_delete_movie(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    movie_number = query.data.replace("delete_", "")
+    _, (movie_number,) = callback_router.decode(query.data)
     if movie_number in movies_data:
         del movies_data[movie_number]
-        save_json("movies.json", movies_data)
+        parts_keyboards.invalidate(movie_number)
+        catalog_index.remove(movie_number)
+        search_index.remove(movie_number)
+        await storage.delete_movie(movie_number)
         await query.edit_message_text(f"✅ Anime o'chirildi: {movie_number}")
     else:
         await query.edit_message_text("Anime topilmadi!")
@@ -325,14 +2748,9 @@ async def confirm_delete_movie(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
-    if query.from_user.id not in ADMIN_IDS:
-        await query.edit_message_text("Siz admin emassiz!")
-        return ConversationHandler.END
-
     keyboard = [
-        [InlineKeyboardButton("📢 Public kanal", callback_data="public_channel")],
-        [InlineKeyboardButton("🔒 Private kanal", callback_data="private_channel")],
+        [InlineKeyboardButton("📢 Public kanal", callback_data=callback_router.encode("ct", "public"))],
+        [InlineKeyboardButton("🔒 Private kanal", callback_data=callback_router.encode("ct", "private"))],
     ]
     await query.message.reply_text("Kanal turini tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
     return ADD_CHANNEL_TYPE
@@ -340,7 +2758,8 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def channel_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    context.user_data["channel_type"] = query.data
+    _, (kind,) = callback_router.decode(query.data)
+    context.user_data["channel_type"] = f"{kind}_channel"
     await query.message.reply_text(
         "Public kanal username’ni @ bilan kiriting (@channelname) yoki Private kanal ID’sini kiriting (-1001234567890):"
     )
@@ -377,7 +2796,8 @@ async def add_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Kanal mavjudligini tekshirish
         await context.bot.get_chat(channel)
         CHANNELS.append(channel)
-        save_json("channels.json", CHANNELS)
+        await storage.add_channel(channel)
+        subscription_cache.clear()
         await update.message.reply_text(f"✅ Kanal qo‘shildi: {channel}")
     except Exception as e:
         logger.error(f"Kanal qo‘shishda xatolik: {e}")
@@ -388,16 +2808,11 @@ async def add_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
-    if query.from_user.id not in ADMIN_IDS:
-        await query.edit_message_text("Siz admin emassiz!")
-        return ConversationHandler.END
-
     if not CHANNELS:
         await query.edit_message_text("Kanal mavjud emas!")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(str(channel), callback_data=f"select_{channel}")]
+    keyboard = [[InlineKeyboardButton(str(channel), callback_data=callback_router.encode("rs", channel))]
                 for channel in CHANNELS]
     await query.edit_message_text("O‘chirish uchun kanalni tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
     return REMOVE_CHANNEL
@@ -405,10 +2820,10 @@ async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def select_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    channel_to_delete = query.data.replace("select_", "")
+    _, (channel_to_delete,) = callback_router.decode(query.data)
     keyboard = [
-        [InlineKeyboardButton("✅ Ha, o'chirish", callback_data=f"confirm_delete_{channel_to_delete}")],
-        [InlineKeyboardButton("❌ Yo'q", callback_data="cancel_delete")],
+        [InlineKeyboardButton("✅ Ha, o'chirish", callback_data=callback_router.encode("ry", channel_to_delete))],
+        [InlineKeyboardButton("❌ Yo'q", callback_data=callback_router.encode("rn"))],
     ]
     await query.edit_message_text(f"Kanalni o'chirishni tasdiqlaysizmi: {channel_to_delete}?", reply_markup=InlineKeyboardMarkup(keyboard))
     return REMOVE_CHANNEL
@@ -416,13 +2831,15 @@ async def select_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def confirm_delete_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    channel_to_delete = query.data.replace("confirm_delete_", "")
+    _, (channel_to_delete,) = callback_router.decode(query.data)
 
     try:
         channel_to_remove = channel_to_delete if channel_to_delete.startswith("@") else int(channel_to_delete)
         if channel_to_remove in CHANNELS:
             CHANNELS.remove(channel_to_remove)
-            save_json("channels.json", CHANNELS)
+            await storage.remove_channel(channel_to_remove)
+            subscription_cache.clear()
+            membership_index.retain(CHANNELS)
             await query.edit_message_text(f"✅ Kanal o‘chirildi: {channel_to_delete}")
         else:
             await query.edit_message_text("Kanal topilmadi!")
@@ -438,30 +2855,26 @@ async def cancel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
     await query.message.reply_text("Broadcast xabar matnini kiriting:")
     return BROADCAST_MESSAGE
 
 async def send_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message = update.message.text
-    success_count = 0
-    for user_id in users_data.keys():
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Xabar yuborishda xatolik {user_id}: {e}")
-    await update.message.reply_text(f"✅ Xabar {success_count} foydalanuvchiga yuborildi!")
+    # Yuborish fonda davom etadi, admin suhbati darhol yakunlanadi
+    if IS_PRIMARY:
+        await broadcast_manager.start(context.bot, message, update.message.chat_id, user_registry.active_ids())
+    else:
+        # Broadcast holati bitta jarayonda yuritiladi, shuning uchun ish asosiy jarayonga uzatiladi
+        await storage.publish("broadcast", {"text": message, "admin_chat_id": update.message.chat_id})
     return ConversationHandler.END
 
 async def post_to_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
     if not CHANNELS:
         await query.edit_message_text("Kanal mavjud emas! Avval kanal qo‘shing.")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(str(channel), callback_data=f"post_select_{channel}")]
+    keyboard = [[InlineKeyboardButton(str(channel), callback_data=callback_router.encode("ps", channel))]
                 for channel in CHANNELS]
     await query.edit_message_text("Post yuborish uchun kanalni tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
     return POST_TO_CHANNEL
@@ -469,13 +2882,13 @@ async def post_to_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def select_channel_for_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    channel_id = query.data.replace("post_select_", "")
+    _, (channel_id,) = callback_router.decode(query.data)
     try:
         context.user_data["selected_channel"] = channel_id if channel_id.startswith("@") else int(channel_id)
         keyboard = [
-            [InlineKeyboardButton("📝 Faqat matn", callback_data="type_text")],
-            [InlineKeyboardButton("🖼 Rasm bilan", callback_data="type_photo")],
-            [InlineKeyboardButton("🎥 Video bilan", callback_data="type_video")],
+            [InlineKeyboardButton("📝 Faqat matn", callback_data=callback_router.encode("pt", "text"))],
+            [InlineKeyboardButton("🖼 Rasm bilan", callback_data=callback_router.encode("pt", "photo"))],
+            [InlineKeyboardButton("🎥 Video bilan", callback_data=callback_router.encode("pt", "video"))],
         ]
         await query.edit_message_text(f"Tanlangan kanal: {channel_id}\nPost turini tanlang:", reply_markup=InlineKeyboardMarkup(keyboard))
         return POST_TYPE
@@ -486,7 +2899,7 @@ async def select_channel_for_post(update: Update, context: ContextTypes.DEFAULT_
 async def select_post_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    context.user_data["post_type"] = query.data.replace("type_", "")
+    _, (context.user_data["post_type"],) = callback_router.decode(query.data)
     await query.edit_message_text("Post matnini kiriting:")
     return POST_TEXT
 
@@ -536,7 +2949,7 @@ async def send_post_to_channel(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def handle_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    if not all([await is_subscribed(user_id, context, channel) for channel in CHANNELS]):
+    if await get_missing_channels(user_id, context):
         await update.message.reply_text("Avval barcha kanallarga obuna bo‘ling.")
         return
 
@@ -551,50 +2964,31 @@ async def handle_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         context.user_data["movie_number"] = number
         context.user_data["selected_part_index"] = 0
         parts = video_info["part_data"]
-        parts_per_page = 5
-        start_idx = context.user_data["current_page"] * parts_per_page
-        end_idx = start_idx + parts_per_page
-        visible_parts = parts[start_idx:end_idx]
 
-        keyboard = []
-        for i, part in enumerate(parts[start_idx + 1:end_idx], start=start_idx + 1):
-            keyboard.append([InlineKeyboardButton(f"{part['part_name']}", callback_data=f"part_{number}_{i}")])
-
-        nav_row = []
-        total_pages = (len(parts) + parts_per_page - 1) // parts_per_page
-        if context.user_data["current_page"] > 0:
-            nav_row.append(InlineKeyboardButton("⬅️", callback_data=f"nav_{number}_prev"))
-        if context.user_data["current_page"] < total_pages - 1:
-            nav_row.append(InlineKeyboardButton("➡️", callback_data=f"nav_{number}_next"))
-        if nav_row:
-            keyboard.append(nav_row)
-
-        message = await update.message.reply_video(
-            video=parts[0]["part_url"],
-            caption=f"📄 {video_info['title']}\n🔗 {parts[0]['part_name']}\n👁 {video_info['views']}",
-            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+        message = await send_catalog_video(
+            update.message.reply_video, number, 0,
+            caption=f"📄 {video_info['title']}\n🔗 {parts[0]['part_name']}\n👁 {view_counter.views(number)}",
+            reply_markup=parts_keyboards.get(number, 0, 0)
         )
         context.user_data["last_message_id"] = message.message_id
         context.user_data["last_chat_id"] = message.chat_id
     else:
-        await update.message.reply_video(
-            video=video_info["video_url"],
-            caption=f"📄 {video_info['title']}\n👁 {video_info['views']}"
+        await send_catalog_video(
+            update.message.reply_video, number,
+            caption=f"📄 {video_info['title']}\n👁 {view_counter.views(number)}"
         )
 
-    video_info["views"] += 1
-    save_json("movies.json", movies_data)
+    view_counter.increment(number)
 
 async def handle_part_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    if not all([await is_subscribed(user_id, context, channel) for channel in CHANNELS]):
+    if await get_missing_channels(user_id, context):
         await query.edit_message_text("Avval barcha kanallarga obuna bo‘ling.")
         return
 
-    data = query.data.split("_")
-    movie_number, part_index = data[1], int(data[2])
+    _, (movie_number, part_index) = callback_router.decode(query.data)
     video_info = movies_data.get(movie_number)
     if not video_info or "part_data" not in video_info or part_index >= len(video_info["part_data"]):
         await query.message.reply_text("Qism topilmadi!")
@@ -612,226 +3006,1010 @@ async def handle_part_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
     part = video_info["part_data"][part_index]
     context.user_data["selected_part_index"] = part_index
-    parts = video_info["part_data"]
-    parts_per_page = 5
     current_page = context.user_data.get("current_page", 0)
-    start_idx = current_page * parts_per_page
-    end_idx = start_idx + parts_per_page
-
-    keyboard = []
-    for i, p in enumerate(parts):
-        if i != part_index and start_idx <= i < end_idx:
-            keyboard.append([InlineKeyboardButton(f"{p['part_name']}", callback_data=f"part_{movie_number}_{i}")])
 
-    nav_row = []
-    total_pages = (len(parts) + parts_per_page - 1) // parts_per_page
-    if current_page > 0:
-        nav_row.append(InlineKeyboardButton("⬅️", callback_data=f"nav_{movie_number}_prev"))
-    if current_page < total_pages - 1:
-        nav_row.append(InlineKeyboardButton("➡️", callback_data=f"nav_{movie_number}_next"))
-    if nav_row:
-        keyboard.append(nav_row)
-
-    message = await query.message.reply_video(
-        video=part["part_url"],
-        caption=f"📄 {video_info['title']}\n🔗 {part['part_name']}\n👁 {video_info['views']}",
-        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+    message = await send_catalog_video(
+        query.message.reply_video, movie_number, part_index,
+        caption=f"📄 {video_info['title']}\n🔗 {part['part_name']}\n👁 {view_counter.views(movie_number)}",
+        reply_markup=parts_keyboards.get(movie_number, current_page, part_index)
     )
     context.user_data["last_message_id"] = message.message_id
     context.user_data["last_chat_id"] = message.chat_id
-    video_info["views"] += 1
-    save_json("movies.json", movies_data)
+    view_counter.increment(movie_number)
 
 async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    data = query.data.split("_")
-    movie_number, action = data[1], data[2]
+    _, (movie_number, step) = callback_router.decode(query.data)
     video_info = movies_data.get(movie_number)
     if not video_info or "part_data" not in video_info:
         await query.message.reply_text("Qism topilmadi!")
         return
 
     current_page = context.user_data.get("current_page", 0)
-    parts_per_page = 5
-    total_pages = (len(video_info["part_data"]) + parts_per_page - 1) // parts_per_page
-    if action == "prev" and current_page > 0:
-        context.user_data["current_page"] -= 1
-    elif action == "next" and current_page < total_pages - 1:
-        context.user_data["current_page"] += 1
-
-    current_page = context.user_data["current_page"]
-    start_idx = current_page * parts_per_page
-    end_idx = start_idx + parts_per_page
+    total_pages = parts_keyboards.total_pages(movie_number)
+    current_page = min(max(current_page + step, 0), max(total_pages - 1, 0))
+    context.user_data["current_page"] = current_page
     selected_part_index = context.user_data.get("selected_part_index", 0)
 
-    keyboard = []
-    for i, part in enumerate(video_info["part_data"]):
-        if i != selected_part_index and start_idx <= i < end_idx:
-            keyboard.append([InlineKeyboardButton(f"{part['part_name']}", callback_data=f"part_{movie_number}_{i}")])
-
-    nav_row = []
-    if current_page > 0:
-        nav_row.append(InlineKeyboardButton("⬅️", callback_data=f"nav_{movie_number}_prev"))
-    if current_page < total_pages - 1:
-        nav_row.append(InlineKeyboardButton("➡️", callback_data=f"nav_{movie_number}_next"))
-    if nav_row:
-        keyboard.append(nav_row)
-
     try:
         await context.bot.edit_message_reply_markup(
             chat_id=context.user_data["last_chat_id"],
             message_id=context.user_data["last_message_id"],
-            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+            reply_markup=parts_keyboards.get(movie_number, current_page, selected_part_index)
         )
     except Exception as e:
         logger.error(f"Xabarni tahrirlashda xatolik: {e}")
 
-async def webhook_handler(request):
+# Admin panel amallari: nom -> (tugma matni, amal). Tartib klaviatura tartibi bilan bir xil.
+# Amallar faqat admin_panel orqali chaqiriladi, shuning uchun admin tekshiruvi va
+# query.answer() ularning ichida takrorlanmaydi.
+ADMIN_ACTIONS = {
+    "add_movie_parts": ("🎮 Qismli Anime qo‘shish", ask_parts_movie_title),
+    "add_simple_movie": ("🎬 Oddiy Anime qo‘shish", ask_simple_movie_title),
+    "add_channel": ("📢 Kanal qo‘shish", add_channel),
+    "remove_channel": ("❌ Kanalni o'chirish", remove_channel),
+    "delete_movie": ("🗑 Animeni o'chirish", delete_movie),
+    "add_new_part": ("➕ Yangi qism qo‘shish", add_new_part),
+    "post_to_channel": ("📤 Kanalga post yuborish", post_to_channel),
+    "user_count": ("👥 Foydalanuvchilar soni", send_user_count),
+    "broadcast": ("📩 Broadcast", broadcast),
+    "restart_bot": ("🔄 Botni qayta ishga tushirish", restart_bot),
+}
+
+# Admin klaviaturasi o'zgarmaydi: birinchi /start da quriladi va qayta ishlatiladi
+@functools.lru_cache(maxsize=None)
+def admin_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=callback_router.encode("a", name))]
+        for name, (label, _) in ADMIN_ACTIONS.items()
+    ])
+
+callback_router.handlers.update({
+    "p": handle_part_selection,
+    "n": handle_navigation,
+    "cs": check_subscription,
+    "a": admin_panel,
+})
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    inline_query = update.inline_query
+    numbers = search_index.search(inline_query.query)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page = numbers[offset:offset + INLINE_RESULTS_LIMIT]
+    results = [
+        InlineQueryResultArticle(
+            id=number,
+            title=f"{number}: {movies_data[number]['title']}",
+            description=f"{len(movies_data[number]['part_data'])} qism" if "part_data" in movies_data[number] else None,
+            # Tanlangan natija anime raqami sifatida yuboriladi va handle_number uni ochadi
+            input_message_content=InputTextMessageContent(number),
+        )
+        for number in page if number in movies_data
+    ]
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if offset + INLINE_RESULTS_LIMIT < len(numbers) else ""
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
+# restart_bot to'xtatishni so'raganda main() dagi stop_event o'rnatiladi
+stop_event = None
+restart_requested = False
+# Oldingi jarayondan qolgan yangilanishlar navbatga qo'yilgandan keyin True. Ungacha webhookka
+# kelganlari deferred_updates da kutadi, aks holda yangi yangilanish eskisidan oldin ishlanardi.
+pending_replayed = False
+deferred_updates = deque()
+
+# Webhook orqali kelgan yangilanishlar navbati. Yangilanishlar foydalanuvchi (bo'lmasa chat)
+# bo'yicha zanjirlarga ajratiladi: bitta foydalanuvchiniki qat'iy ketma-ket, turli
+# foydalanuvchilarniki parallel ishlanadi, bir vaqtda `workers` tadan ko'p emas.
+class WebhookIngress:
+    def __init__(self, maxsize: int, workers: int, dedup_size: int):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.dedup_size = dedup_size
+        self.queue = None
+        self._recent = OrderedDict()
+        self._dispatcher = None
+        self._slots = None
+        self._chains = {}
+        self._tasks = set()
+        self._pending = 0
+        self._processing = True
+        self._active = 0
+        self._held = []
+
+    # Navbatda turgan va ishlanayotgan yangilanishlar soni
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    @staticmethod
+    def ordering_key(data: dict):
+        for value in data.values():
+            if isinstance(value, dict):
+                sender = value.get("from") or value.get("user")
+                if sender:
+                    return sender.get("id")
+                chat = value.get("chat") or (value.get("message") or {}).get("chat")
+                if chat:
+                    return chat.get("id")
+        return ("update", data.get("update_id"))
+
+    def is_duplicate(self, update_id) -> bool:
+        return update_id in self._recent
+
+    def submit(self, data: dict) -> bool:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self._pending >= self.maxsize:
+            return False
+        self.queue.put_nowait(data)
+        self._pending += 1
+        # update_id faqat navbatga qo'yilgandan keyin eslab qolinadi: 503 dan keyin
+        # Telegram qayta yuborgan yangilanish dublikat hisoblanmasligi kerak
+        self._recent[data.get("update_id")] = None
+        while len(self._recent) > self.dedup_size:
+            self._recent.popitem(last=False)
+        return True
+
+    async def start(self, application) -> None:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.create_task(self._dispatch(application))
+
+    async def stop(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+        # Zanjirlarda kutib turganlar keyingi jarayon uchun saqlanadi
+        for chain in self._chains.values():
+            while chain:
+                self._held.append(chain.popleft())
+                self._finish()
+        tasks = [self._dispatcher, *self._tasks] if self._dispatcher else list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._tasks = set()
+
+    def _finish(self) -> None:
+        self._pending -= 1
+        self.queue.task_done()
+
+    # Navbatni o'qib, har bir yangilanishni o'z foydalanuvchisi zanjiriga qo'shadi
+    async def _dispatch(self, application) -> None:
+        while True:
+            data = await self.queue.get()
+            key = self.ordering_key(data)
+            chain = self._chains.get(key)
+            if chain is not None:
+                chain.append(data)
+                continue
+            chain = self._chains[key] = deque([data])
+            task = asyncio.create_task(self._run_chain(application, key, chain))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_chain(self, application, key, chain) -> None:
+        try:
+            while chain:
+                data = chain.popleft()
+                try:
+                    async with self._slots:
+                        if not self._processing:
+                            # To'xtatish boshlangan: yangilanish keyingi jarayon uchun saqlab qo'yiladi
+                            self._held.append(data)
+                            continue
+                        self._active += 1
+                        try:
+                            await application.process_update(Update.de_json(data, application.bot))
+                        except Exception as e:
+                            logger.error(f"Yangilanishni qayta ishlashda xatolik: {e}")
+                        finally:
+                            self._active -= 1
+                finally:
+                    self._finish()
+        finally:
+            self._chains.pop(key, None)
+
+    # process_queue=True bo'lsa navbat oxirigacha ishlanadi, aks holda faqat boshlangan
+    # yangilanishlar tugashi kutiladi. Ikkalasi ham `timeout` soniya bilan cheklangan.
+    async def drain(self, timeout: float, process_queue: bool) -> None:
+        deadline = time.monotonic() + timeout
+        if process_queue and self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Navbat {timeout:.0f} soniyada tugamadi, {self._pending} ta yangilanish saqlanadi")
+        self._processing = False
+        while self._active and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._active:
+            logger.warning(f"{self._active} ta yangilanish ishlovi muddatda tugamadi va to'xtatildi")
+        await self.stop()
+
+    # Navbatda qolgan va ushlab turilgan yangilanishlarni qaytaradi
+    def take_remaining(self) -> list:
+        remaining, self._held = self._held, []
+        while self.queue is not None and not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+            self._finish()
+        return remaining
+
+webhook_ingress = WebhookIngress(WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_DEDUP_SIZE)
+
+# Boshqa jarayonlar SQLite ga yozgan o'zgarishlarni o'qib, shu jarayon xotirasidagi
+# ma'lumotlar va keshlarni yangilaydi. Faqat BOT_WORKERS > 1 da ishlaydi.
+class ChangeFeed:
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_id = 0
+        self._last_prune = 0.0
+
+    async def run(self, bot) -> None:
+        self.last_id = await persistence_writer.call(storage.last_change_id)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll(bot)
+                if IS_PRIMARY and time.monotonic() - self._last_prune > self.PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    await storage.prune_changes()
+            except Exception as e:
+                logger.error(f"O'zgarishlarni o'qishda xatolik: {e}")
+
+    async def poll(self, bot) -> None:
+        for change_id, origin, kind, key, payload in await storage.read_changes(self.last_id):
+            self.last_id = change_id
+            if origin == WORKER_INDEX:
+                continue
+            if kind == "movie":
+                await self._apply_movie(key)
+            elif kind == "user":
+                await self._apply_user(key)
+            elif kind == "user_active":
+                payload = json.loads(payload)
+                for user_id in payload["ids"]:
+                    user_registry.set_active(int(user_id), payload["active"])
+            elif kind == "channels":
+                CHANNELS[:] = await storage.reload_channels()
+                subscription_cache.clear()
+                membership_index.retain(CHANNELS)
+            elif kind == "membership":
+                for channel, user_id, member in json.loads(payload):
+                    membership_index.set(user_id, channel, member, track=True, persist=False)
+            elif kind == "broadcast" and IS_PRIMARY:
+                payload = json.loads(payload)
+                await broadcast_manager.start(bot, payload["text"], payload["admin_chat_id"], user_registry.active_ids())
+
+    async def _apply_movie(self, number: str) -> None:
+        movie = await storage.load_movie(number)
+        parts_keyboards.invalidate(number)
+        if movie is None:
+            movies_data.pop(number, None)
+            catalog_index.remove(number)
+            search_index.remove(number)
+            return
+        movies_data[number] = movie
+        catalog_index.add(number, movie)
+        search_index.add(number, movie["title"])
+
+    async def _apply_user(self, user_id: str) -> None:
+        user = await storage.load_user(user_id)
+        if user is not None:
+            user_registry.add_json(user_id, user)
+
+change_feed = ChangeFeed(CHANGE_POLL_INTERVAL)
+
+# context.user_data va suhbat holatlarini omborda saqlaydi. PTB har update_interval da
+# yangilanish kelgan foydalanuvchilarni beradi; ulardan faqat ma'lumoti haqiqatan
+# o'zgarganlari bitta paketda yoziladi. Sahifalash kalitlari bitta ixcham ro'yxatga
+# yig'iladi, ttl davomida faol bo'lmagan foydalanuvchilar xotiradan va ombordan o'chiriladi.
+class BotPersistence(BasePersistence):
+    PAGINATION_KEYS = ("current_page", "last_message_id", "last_chat_id", "selected_part_index")
+    EXPIRE_INTERVAL = 600
+
+    def __init__(self, ttl: float, update_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.ttl = ttl
+        self._written = {}
+        self._touched = {}
+        self._upserts = {}
+        self._deletes = set()
+        self._conversations = {}
+        self._batch = None
+
+    @classmethod
+    def encode(cls, data: dict) -> str:
+        data = dict(data)
+        pagination = [data.pop(key, None) for key in cls.PAGINATION_KEYS]
+        if any(value is not None for value in pagination):
+            data["#"] = pagination
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else ""
+
+    @classmethod
+    def decode(cls, encoded: str) -> dict:
+        data = json.loads(encoded)
+        for key, value in zip(cls.PAGINATION_KEYS, data.pop("#", ())):
+            if value is not None:
+                data[key] = value
+        return data
+
+    async def get_user_data(self) -> dict:
+        rows = await persistence_writer.call(storage.load_user_states, time.time() - self.ttl)
+        user_data = {}
+        for user_id, encoded, updated in rows:
+            self._written[user_id] = encoded
+            user_data[user_id] = self.decode(encoded)
+        logger.info(f"{len(user_data)} ta foydalanuvchi holati yuklandi")
+        return user_data
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await persistence_writer.call(storage.load_conversations, name, time.time() - self.ttl)
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._touched[user_id] = time.monotonic()
+        try:
+            encoded = self.encode(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Foydalanuvchi {user_id} holatini saqlab bo'lmadi: {e}")
+            return
+        if self._written.get(user_id, "") == encoded:
+            return
+        if encoded:
+            self._written[user_id] = encoded
+            self._upserts[user_id] = encoded
+            self._deletes.discard(user_id)
+        else:
+            self._written.pop(user_id, None)
+            self._upserts.pop(user_id, None)
+            self._deletes.add(user_id)
+        self._schedule()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._touched.pop(user_id, None)
+        if self._written.pop(user_id, None) is not None:
+            self._upserts.pop(user_id, None)
+            self._deletes.add(user_id)
+            self._schedule()
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._batch is not None:
+            await self._batch
+        if self._upserts or self._deletes or self._conversations:
+            await self._write_batch()
+
+    # Bitta update_persistence davridagi barcha o'zgarishlar bitta yozuvga yig'iladi
+    def _schedule(self) -> None:
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_task(self._write_batch())
+
+    async def _write_batch(self) -> None:
+        await asyncio.sleep(0)
+        upserts, deletes, conversations = self._upserts, self._deletes, self._conversations
+        self._upserts, self._deletes, self._conversations, self._batch = {}, set(), {}, None
+        try:
+            await storage.save_user_states(upserts, deletes, conversations, time.time())
+        except Exception as e:
+            logger.error(f"Foydalanuvchi holatlarini saqlashda xatolik: {e}")
+            # Keyingi paketda qayta urinib ko'riladi, yangiroq o'zgarishlar ustun
+            for user_id, encoded in upserts.items():
+                if user_id not in self._deletes:
+                    self._upserts.setdefault(user_id, encoded)
+            self._deletes |= {user_id for user_id in deletes if user_id not in self._upserts}
+            for key, state in conversations.items():
+                self._conversations.setdefault(key, state)
+
+    # ttl davomida yangilanish kelmagan foydalanuvchilar ma'lumoti xotiradan chiqariladi
+    def expire(self, application: Application) -> int:
+        now = time.monotonic()
+        expired = 0
+        for user_id in list(application.user_data):
+            touched = self._touched.setdefault(user_id, now)
+            if now - touched > self.ttl:
+                application.drop_user_data(user_id)
+                self._touched.pop(user_id, None)
+                self._written.pop(user_id, None)
+                expired += 1
+        return expired
+
+    async def run(self, application: Application) -> None:
+        while True:
+            await asyncio.sleep(min(self.EXPIRE_INTERVAL, self.ttl))
+            try:
+                expired = self.expire(application)
+                await storage.prune_user_states(time.time() - self.ttl)
+                if expired:
+                    logger.info(f"{expired} ta faol bo'lmagan foydalanuvchi holati o'chirildi")
+            except Exception as e:
+                logger.error(f"Foydalanuvchi holatlarini tozalashda xatolik: {e}")
+
+bot_persistence = BotPersistence(USER_STATE_TTL, USER_STATE_FLUSH_INTERVAL)
+
+metrics.register(Gauge("bot_webhook_queue_depth", "Webhook navbatidagi yangilanishlar",
+                       lambda: webhook_ingress.depth))
+metrics.register(Gauge("bot_persistence_queue_depth", "Diskka yozish navbati", lambda: persistence_writer.queue_depth))
+metrics.register(Gauge("bot_catalog_size", "Katalogdagi animelar soni", lambda: len(movies_data)))
+metrics.register(Gauge("bot_users_total", "Ro'yxatdan o'tgan foydalanuvchilar", lambda: len(user_registry)))
+metrics.register(Gauge("bot_users_active", "Faol foydalanuvchilar", lambda: user_registry.active_count))
+metrics.register(Gauge("bot_user_states", "Xotiradagi foydalanuvchi holatlari", lambda: len(bot_persistence._touched)))
+metrics.register(Gauge("bot_flood_buckets", "Xotiradagi flood bucketlar soni", lambda: len(flood_limiter)))
+metrics.register(Gauge("bot_subscription_cache_hits", "Obuna keshi hitlari", lambda: subscription_cache.hits))
+metrics.register(Gauge("bot_subscription_cache_misses", "Obuna keshi misslari", lambda: subscription_cache.misses))
+metrics.register(Gauge("bot_membership_entries", "A'zolik indeksidagi yozuvlar", lambda: len(membership_index)))
+metrics.register(Gauge("bot_membership_hits", "A'zolik indeksidan javob berilgan tekshiruvlar", lambda: membership_index.hits))
+metrics.register(Gauge("bot_join_digest_pending", "Yig'ma xabarga kutayotgan yangi foydalanuvchilar",
+                       lambda: join_notifier._count))
+
+# Handler callbackini vaqt o'lchovchi o'ram bilan almashtiradi. ConversationHandler
+# ichidagi barcha holat handlerlari ham o'raladi.
+def instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            instrument_handler(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                instrument_handler(nested)
+        return handler
+    callback = handler.callback
+    if getattr(callback, "__instrumented__", False):
+        return handler
+    name = getattr(callback, "__name__", "handler")
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            result = callback(update, context)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    timed.__instrumented__ = True
+    handler.callback = timed
+    return handler
+
+def add_handler(application, handler, group: int = 0) -> None:
+    application.add_handler(instrument_handler(handler), group)
+
+async def metrics_handler(request):
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return web.Response(status=403)
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+# Telegram so'rovidan yangilanishni o'qiydi; xatolik bo'lsa tayyor javob qaytaradi
+async def read_webhook_update(request):
+    # Maxfiy token JSON o'qilishidan oldin tekshiriladi
+    if WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+        return web.Response(status=403)
     try:
-        update = await request.json()
-        update = Update.de_json(update, application.bot)
-        await application.process_update(update)
-        return web.Response(text="OK")
+        data = await request.json()
     except Exception as e:
         logger.error(f"Webhook xatoligi: {e}")
-        return web.Response(status=500)
+        return web.Response(status=400)
+    if not isinstance(data, dict):
+        return web.Response(status=400)
+    return data
 
-async def main() -> None:
-    global application
-    application = Application.builder().token(BOT_TOKEN).build()
+async def webhook_handler(request):
+    data = await read_webhook_update(request)
+    if isinstance(data, web.Response):
+        return data
+    if webhook_ingress.is_duplicate(data.get("update_id")):
+        return web.Response(text="OK")
+    if not pending_replayed:
+        if len(deferred_updates) >= WEBHOOK_QUEUE_SIZE:
+            logger.warning("Oldingi jarayon yangilanishlari kutilmoqda, navbat to'lgan, yangilanish rad etildi")
+            return web.Response(status=503)
+        deferred_updates.append(data)
+        return web.Response(text="OK")
+    if not webhook_ingress.submit(data):
+        logger.warning("Webhook navbati to'lgan, yangilanish rad etildi")
+        return web.Response(status=503)
+    return web.Response(text="OK")
+
+# Nazoratchidan kelgan yangilanishlar to'plami. Javobda navbatga olinganlar soni
+# qaytariladi, qolganini nazoratchi keyinroq shu tartibda qayta yuboradi. Oldingi
+# jarayondan qolgan yangilanishlar navbatga qo'yilmaguncha hech narsa olinmaydi.
+async def router_handler(request):
+    if not ROUTER_SECRET or not hmac.compare_digest(request.headers.get(ROUTER_SECRET_HEADER, ""), ROUTER_SECRET):
+        return web.Response(status=403)
+    batch = await request.json()
+    accepted = 0
+    if pending_replayed:
+        for data in batch:
+            if not webhook_ingress.is_duplicate(data.get("update_id")) and not webhook_ingress.submit(data):
+                break
+            accepted += 1
+    return web.json_response({"accepted": accepted})
+
+# Application va barcha handlerlarni yaratadi. base_url sinov/benchmark uchun
+# Bot API o'rnini bosuvchi serverga yo'naltirishda ishlatiladi.
+def build_application(token: str = BOT_TOKEN, base_url: str = None) -> Application:
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .persistence(bot_persistence)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
 
     # Conversation Handlers
-    conv_handler_parts = ConversationHandler(
-        entry_points=[CallbackQueryHandler(admin_panel, pattern="^add_movie_parts$")],
+    delete_navigate, delete_search = catalog_handlers("delete")
+    addpart_navigate, addpart_search = catalog_handlers("addpart")
+    # Barcha admin oqimlari bitta suhbatda: har bir admin uchun faqat bitta holat bo'ladi,
+    # shuning uchun tashlab ketilgan oqim boshqasining matnini olmaydi. Istalgan admin
+    # tugmasi (allow_reentry) joriy oqimni tugatib, yangisini boshlaydi. Matn alohida
+    # xabar bo'lib keladi, shuning uchun suhbat xabarga emas, chatga bog'lanadi.
+    conv_handler_admin = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_panel, pattern=callback_router.pattern("a"))],
         states={
+            # Qismli anime
             MOVIE_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, movie_title)],
             MOVIE_PARTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, movie_parts)],
             MOVIE_PART_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, movie_part_url)],
             MOVIE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, movie_number)],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_simple = ConversationHandler(
-        entry_points=[CallbackQueryHandler(admin_panel, pattern="^add_simple_movie$")],
-        states={
+            # Oddiy anime
             SIMPLE_MOVIE_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, simple_movie_title)],
             SIMPLE_MOVIE_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, simple_movie_url)],
             SIMPLE_MOVIE_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, simple_movie_number)],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_delete = ConversationHandler(
-        entry_points=[CallbackQueryHandler(delete_movie, pattern="^delete_movie$")],
-        states={
-            DELETE_MOVIE: [CallbackQueryHandler(confirm_delete_movie, pattern="^delete_")],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_remove_channel = ConversationHandler(
-        entry_points=[CallbackQueryHandler(remove_channel, pattern="^remove_channel$")],
-        states={
-            REMOVE_CHANNEL: [
-                CallbackQueryHandler(select_channel, pattern="^select_"),
-                CallbackQueryHandler(confirm_delete_channel, pattern="^confirm_delete_"),
-                CallbackQueryHandler(cancel_delete, pattern="^cancel_delete$"),
+            # Katalog: o'chirish va yangi qism
+            DELETE_MOVIE: [
+                CallbackQueryHandler(confirm_delete_movie, pattern=callback_router.pattern("dm")),
+                CallbackQueryHandler(delete_navigate, pattern=callback_router.pattern("cp", "delete")),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, delete_search),
+            ],
+            ADD_NEW_PART_SELECT: [
+                CallbackQueryHandler(select_movie_for_new_part, pattern=callback_router.pattern("ap")),
+                CallbackQueryHandler(addpart_navigate, pattern=callback_router.pattern("cp", "addpart")),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, addpart_search),
             ],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_broadcast = ConversationHandler(
-        entry_points=[CallbackQueryHandler(broadcast, pattern="^broadcast$")],
-        states={
-            BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast_message)],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_add_channel = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_channel, pattern="^add_channel$")],
-        states={
-            ADD_CHANNEL_TYPE: [CallbackQueryHandler(channel_type, pattern="^(public_channel|private_channel)$")],
-            ADD_CHANNEL_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_channel_id)],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_add_new_part = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_new_part, pattern="^add_new_part$")],
-        states={
-            ADD_NEW_PART_SELECT: [CallbackQueryHandler(select_movie_for_new_part, pattern="^add_part_")],
             ADD_NEW_PART_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_new_part_name)],
             ADD_NEW_PART_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_new_part_url)],
-        },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
-    )
-
-    conv_handler_post_to_channel = ConversationHandler(
-        entry_points=[CallbackQueryHandler(post_to_channel, pattern="^post_to_channel$")],
-        states={
-            POST_TO_CHANNEL: [CallbackQueryHandler(select_channel_for_post, pattern="^post_select_")],
-            POST_TYPE: [CallbackQueryHandler(select_post_type, pattern="^type_")],
+            # Kanallar
+            REMOVE_CHANNEL: [
+                CallbackQueryHandler(select_channel, pattern=callback_router.pattern("rs")),
+                CallbackQueryHandler(confirm_delete_channel, pattern=callback_router.pattern("ry")),
+                CallbackQueryHandler(cancel_delete, pattern=callback_router.pattern("rn")),
+            ],
+            ADD_CHANNEL_TYPE: [CallbackQueryHandler(channel_type, pattern=callback_router.pattern("ct"))],
+            ADD_CHANNEL_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_channel_id)],
+            # Broadcast
+            BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast_message)],
+            # Kanalga post
+            POST_TO_CHANNEL: [CallbackQueryHandler(select_channel_for_post, pattern=callback_router.pattern("ps"))],
+            POST_TYPE: [CallbackQueryHandler(select_post_type, pattern=callback_router.pattern("pt"))],
             POST_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_post_text)],
             POST_MEDIA: [MessageHandler(filters.PHOTO | filters.VIDEO, receive_post_media)],
             POST_BUTTON_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_button_text)],
             POST_BUTTON_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_post_to_channel)],
         },
-        fallbacks=[CommandHandler("cancel", lambda update, context: ConversationHandler.END)],
-        per_message=True,
+        fallbacks=[CommandHandler("cancel", cancel)],
+        allow_reentry=True,
+        per_message=False,
+        name="admin",
+        persistent=True,
     )
 
     # Handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(check_subscription, pattern="^check_sub$"))
-    application.add_handler(CallbackQueryHandler(send_user_count, pattern="^user_count$"))
-    application.add_handler(MessageHandler(filters.ChatType.CHANNEL, get_channel_id))
-    application.add_handler(conv_handler_parts)
-    application.add_handler(conv_handler_simple)
-    application.add_handler(conv_handler_delete)
-    application.add_handler(conv_handler_remove_channel)
-    application.add_handler(conv_handler_broadcast)
-    application.add_handler(conv_handler_add_channel)
-    application.add_handler(conv_handler_add_new_part)
-    application.add_handler(conv_handler_post_to_channel)
-    application.add_handler(CallbackQueryHandler(handle_part_selection, pattern="^part_"))
-    application.add_handler(CallbackQueryHandler(handle_navigation, pattern="^nav_"))
-    application.add_handler(CallbackQueryHandler(admin_panel))
-    application.add_handler(CallbackQueryHandler(restart_bot, pattern="^restart_bot$"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.Regex(r"^\d+$"), handle_number))
-
-    # Webhook sozlash
+    add_handler(application, TypeHandler(Update, flood_guard), group=-1)
+    add_handler(application, ChatMemberHandler(track_channel_member, ChatMemberHandler.CHAT_MEMBER))
+    add_handler(application, CommandHandler("start", start))
+    add_handler(application, InlineQueryHandler(inline_search))
+    add_handler(application, MessageHandler(filters.ChatType.CHANNEL, get_channel_id))
+    add_handler(application, conv_handler_admin)
+    # Qolgan barcha callbacklar kod bo'yicha bitta lug'at qidiruvi bilan yo'naltiriladi
+    add_handler(application, CallbackQueryHandler(callback_router.dispatch))
+    add_handler(application, MessageHandler(filters.TEXT & ~filters.COMMAND & filters.Regex(r"^\d+$"), handle_number))
+    return application
+
+# Webhook manzili, maxfiy kaliti va yangilanish turlari o'zgarmagan bo'lsa set_webhook
+# chaqirilmaydi. Kalitni getWebhookInfo qaytarmaydi, shuning uchun oxirgi o'rnatilgan izi
+# faylda saqlanadi. chat_member yangilanishlari faqat allowed_updates da so'ralsa keladi.
+async def ensure_webhook(bot) -> None:
+    allowed_updates = Update.ALL_TYPES
+    fingerprint = hashlib.sha256(
+        f"{WEBHOOK_URL}\n{WEBHOOK_SECRET or ''}\n{','.join(allowed_updates)}".encode("utf-8")
+    ).hexdigest()
+    file_path = os.path.join(os.getcwd(), WEBHOOK_STATE_FILE)
     try:
-        await application.bot.set_webhook(url=WEBHOOK_URL)
-        logger.info(f"Webhook o'rnatildi: {WEBHOOK_URL}")
-    except Exception as e:
-        logger.error(f"Webhook o'rnatishda xatolik: {e}")
-        raise
+        with open(file_path, "r", encoding="utf-8") as file:
+            saved = file.read().strip()
+    except FileNotFoundError:
+        saved = None
+    if saved == fingerprint:
+        info = await bot.get_webhook_info()
+        if info.url == WEBHOOK_URL:
+            logger.info(f"Webhook o'zgarmagan, qayta o'rnatilmadi: {WEBHOOK_URL}")
+            return
+    await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=allowed_updates)
+    write_file_atomic(file_path, fingerprint.encode("utf-8"))
+    logger.info(f"Webhook o'rnatildi: {WEBHOOK_URL}")
+
+# Metrikalar serveri: webhook ilovasidan alohida, standart holda faqat localhost da
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT + WORKER_INDEX,
+                          reuse_port=hasattr(socket, "SO_REUSEPORT")).start()
+    except OSError as e:
+        logger.error(f"Metrikalar serverini ishga tushirib bo'lmadi ({METRICS_HOST}:{METRICS_PORT + WORKER_INDEX}): {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrikalar: http://{METRICS_HOST}:{METRICS_PORT + WORKER_INDEX}/metrics")
+    return runner
+
+async def main() -> None:
+    global application
+    load_data()
+    application = build_application()
+    startup_timer.mark("application")
+
+    # Webhook sozlash: ko'p jarayonli rejimda faqat asosiy jarayon o'rnatadi
+    if IS_PRIMARY:
+        try:
+            await ensure_webhook(application.bot)
+        except Exception as e:
+            logger.error(f"Webhook o'rnatishda xatolik: {e}")
+            raise
+        startup_timer.mark("webhook")
 
     app = web.Application()
-    app.router.add_post('/', webhook_handler)
+    if BOT_WORKERS > 1:
+        # Tashqi port nazoratchida; ishchi faqat undan keladigan to'plamlarni qabul qiladi
+        app.router.add_post('/', router_handler)
+        site_args = ('127.0.0.1', WORKER_BASE_PORT + WORKER_INDEX)
+    else:
+        app.router.add_post('/', webhook_handler)
+        site_args = ('0.0.0.0', PORT)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
+    # SO_REUSEPORT: restartdagi yangi jarayon eskisi ishlayotgan paytda portni egallaydi
+    site = web.TCPSite(runner, *site_args, reuse_port=hasattr(socket, "SO_REUSEPORT"))
     await site.start()
+    metrics_runner = await start_metrics_server()
+    startup_timer.mark("server")
 
     await application.initialize()
     await application.start()
-    logger.info("Bot ishga tushdi")
+    startup_timer.mark("initialize")
+    await webhook_ingress.start(application)
+    handover_task = asyncio.create_task(replay_pending_updates(os.getenv("BOT_HANDOVER_PID")))
+    views_task = asyncio.create_task(view_counter.run())
+    file_ids_task = asyncio.create_task(file_id_buffer.run())
+    state_task = asyncio.create_task(bot_persistence.run(application))
+    membership_task = asyncio.create_task(membership_index.run(application.bot))
+    join_task = asyncio.create_task(join_notifier.run(application.bot))
+    feed_task = None
+    if BOT_WORKERS > 1:
+        feed_task = asyncio.create_task(change_feed.run(application.bot))
+    warmup_task = None
+    if IS_PRIMARY:
+        await broadcast_manager.resume(application.bot)
+        if FILE_ID_WARMUP_CHAT_ID:
+            warmup_task = asyncio.create_task(warm_up_file_ids(application.bot, FILE_ID_WARMUP_CHAT_ID, FILE_ID_WARMUP_RATE))
+    logger.info(f"Bot ishga tushdi (jarayon {WORKER_INDEX + 1}/{BOT_WORKERS})")
+    startup_timer.report()
+    if os.getenv("BOT_HANDOVER_PID"):
+        # Restart qilgan eski jarayonga port egallanganini bildiradi
+        try:
+            os.kill(int(os.getenv("BOT_HANDOVER_PID")), signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    global stop_event
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        await shutdown(runner, [views_task, file_ids_task, state_task, membership_task, join_task, feed_task, warmup_task, handover_task],
+                       handover=restart_requested and RESTART_HANDOVER and BOT_WORKERS == 1)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+# To'xtatish tartibi: yangi so'rovlarni qabul qilish to'xtatiladi, ishlanayotgan yangilanishlar
+# DRAIN_TIMEOUT gacha kutiladi, broadcast, ko'rishlar va holatlar diskka yoziladi.
+# handover=True bo'lsa eski jarayon so'rov qabul qilishda davom etadi (ular ishlanmay
+# saqlanadi), yangi jarayon portni egallagach to'xtaydi.
+async def shutdown(runner, tasks: list, handover: bool) -> None:
+    started = time.perf_counter()
+    logger.info("Bot to'xtatilmoqda" + (" (yangi jarayonga topshirish bilan)" if handover else ""))
+    if not handover:
+        await runner.cleanup()
+    await webhook_ingress.drain(DRAIN_TIMEOUT, process_queue=not handover)
+    drained = time.perf_counter() - started
+    for task in tasks:
+        if task:
+            task.cancel()
+    await broadcast_manager.stop()
+    await join_notifier.close(application.bot, DRAIN_TIMEOUT)
+    # stop() foydalanuvchi holatlarini oxirgi marta yozadi, shutdown() esa flush qiladi
+    await application.stop()
+    await application.shutdown()
+    await view_counter.flush()
+    await file_id_buffer.flush()
+    await membership_index.flush()
+    await persistence_writer.drain()
+    storage.write_snapshot()
+    if handover:
+        await start_successor()
+        await runner.cleanup()
+    pending = webhook_ingress.take_remaining() + list(deferred_updates)
+    if pending:
+        save_json(HANDOVER_FILE, pending)
+        logger.info(f"{len(pending)} ta ishlanmagan yangilanish keyingi jarayon uchun saqlandi")
+    persistence_writer.close()
+    logger.info(f"Bot to'xtatildi: navbat {drained:.2f}s da tugatildi, jami {time.perf_counter() - started:.2f}s")
+
+# Yangi jarayonni ishga tushiradi va u portni egallab, SIGUSR1 yuborguncha kutadi
+async def start_successor() -> None:
+    ready = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, ready.set)
+    env = dict(os.environ, BOT_HANDOVER_PID=str(os.getpid()))
+    subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env, start_new_session=True)
+    try:
+        await asyncio.wait_for(ready.wait(), HANDOVER_TIMEOUT)
+        logger.info("Yangi jarayon tayyor, eski jarayon to'xtaydi")
+    except asyncio.TimeoutError:
+        logger.error(f"Yangi jarayon {HANDOVER_TIMEOUT:.0f} soniyada tayyor bo'lmadi, eski jarayon baribir to'xtaydi")
+
+# Oldingi jarayon saqlab qoldirgan yangilanishlarni navbatga qo'yadi. Restartda eski
+# jarayon chiqib ketguncha kutiladi, chunki fayl u to'xtaganidan keyin yoziladi. Shu paytda
+# webhookka kelganlari ulardan keyin, kelgan tartibida navbatga qo'yiladi.
+async def replay_pending_updates(previous_pid: str = None) -> None:
+    global pending_replayed
+    try:
+        await _replay_pending_updates(previous_pid)
+    finally:
+        while deferred_updates:
+            data = deferred_updates[0]
+            if not webhook_ingress.is_duplicate(data.get("update_id")):
+                while not webhook_ingress.submit(data):
+                    await asyncio.sleep(0.1)
+            deferred_updates.popleft()
+        pending_replayed = True
+
+async def _replay_pending_updates(previous_pid: str = None) -> None:
+    if previous_pid:
+        deadline = time.monotonic() + DRAIN_TIMEOUT + HANDOVER_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                os.kill(int(previous_pid), 0)
+            except ProcessLookupError:
+                break
+            await asyncio.sleep(0.2)
+    file_path = os.path.join(os.getcwd(), HANDOVER_FILE)
+    if not os.path.exists(file_path):
+        return
+    pending = load_json(HANDOVER_FILE)
+    os.remove(file_path)
+    replayed = 0
+    for data in pending:
+        if webhook_ingress.is_duplicate(data.get("update_id")):
+            continue
+        while not webhook_ingress.submit(data):
+            await asyncio.sleep(0.1)
+        replayed += 1
+    logger.info(f"Oldingi jarayondan qolgan {replayed} ta yangilanish navbatga qo'yildi")
+
+# Ko'p jarayonli rejim nazoratchisi: PORT ni o'zi tinglaydi, yangilanishni ordering_key
+# bo'yicha doim bitta ishchiga yo'naltiradi va har bir ishchi uchun alohida navbatdan
+# to'plamlab, tartibni saqlagan holda uzatadi. Ishchi to'lgan yoki qayta ishga tushayotgan
+# bo'lsa yangilanishlar navbatda kutadi. Kutilmaganda to'xtagan ishchini qayta ishga
+# tushiradi, SIGHUP da hammasini birma-bir qayta ishga tushiradi.
+class WorkerRouter:
+    RETRY_DELAY = 0.2
+
+    def __init__(self, count: int, maxsize: int, batch_size: int):
+        self.count = count
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.secret = secrets.token_hex(16)
+        self.queues = [deque() for _ in range(count)]
+        self.processes = [None] * count
+        self.stopping = False
+        self._wakeups = [asyncio.Event() for _ in range(count)]
+        self._restarting = set()
+
+    @staticmethod
+    def worker_for(key, count: int) -> int:
+        if isinstance(key, int):
+            return key % count
+        return zlib.crc32(repr(key).encode("utf-8")) % count
+
+    def submit(self, data: dict) -> bool:
+        index = self.worker_for(WebhookIngress.ordering_key(data), self.count)
+        if len(self.queues[index]) >= self.maxsize:
+            return False
+        self.queues[index].append(data)
+        self._wakeups[index].set()
+        return True
+
+    async def handle(self, request):
+        data = await read_webhook_update(request)
+        if isinstance(data, web.Response):
+            return data
+        if not self.submit(data):
+            logger.warning("Ishchi navbati to'lgan, yangilanish rad etildi")
+            return web.Response(status=503)
+        return web.Response(text="OK")
 
-    while True:
-        await asyncio.sleep(3600)
+    def spawn(self, index: int) -> None:
+        env = dict(os.environ, BOT_WORKER_INDEX=str(index), BOT_ROUTER_SECRET=self.secret)
+        self.processes[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    async def terminate(self, index: int) -> None:
+        process = self.processes[index]
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+        while process.poll() is None:
+            await asyncio.sleep(0.1)
+
+    async def forward(self, session, index: int) -> None:
+        queue = self.queues[index]
+        url = f"http://127.0.0.1:{WORKER_BASE_PORT + index}/"
+        while True:
+            if not queue:
+                self._wakeups[index].clear()
+                await self._wakeups[index].wait()
+                continue
+            batch = [queue[i] for i in range(min(len(queue), self.batch_size))]
+            accepted = 0
+            try:
+                async with session.post(url, json=batch, headers={ROUTER_SECRET_HEADER: self.secret}) as response:
+                    if response.status == 200:
+                        accepted = (await response.json())["accepted"]
+                    else:
+                        logger.error(f"Ishchi {index} to'plamni rad etdi: {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            for _ in range(accepted):
+                queue.popleft()
+            if accepted < len(batch):
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def restart_all(self) -> None:
+        logger.info("Barcha ishchilar qayta ishga tushirilmoqda")
+        for index in range(self.count):
+            if self.stopping:
+                return
+            self._restarting.add(index)
+            try:
+                await self.terminate(index)
+                if not self.stopping:
+                    self.spawn(index)
+            finally:
+                self._restarting.discard(index)
+        logger.info("Barcha ishchilar qayta ishga tushirildi")
+
+    async def watch(self) -> None:
+        while not self.stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if self.stopping or index in self._restarting or process.poll() is None:
+                    continue
+                logger.warning(f"Ishchi {index} to'xtadi (kod {process.returncode}), qayta ishga tushirilmoqda")
+                self.spawn(index)
+
+    # Uzatilmay qolganlar ishchining HANDOVER fayli oxiriga qo'shiladi: keyingi ishga
+    # tushishda ular ishchi o'zi saqlaganlaridan keyin, to'g'ri tartibda ishlanadi
+    def save_remaining(self) -> None:
+        for index, queue in enumerate(self.queues):
+            if not queue:
+                continue
+            filename = f"pending_updates_{index}.json"
+            pending = load_json(filename) if os.path.exists(os.path.join(os.getcwd(), filename)) else []
+            save_json(filename, pending + list(queue))
+            logger.info(f"Ishchi {index} uchun {len(queue)} ta uzatilmagan yangilanish saqlandi")
+            queue.clear()
+
+async def run_workers(count: int) -> None:
+    router = WorkerRouter(count, WEBHOOK_QUEUE_SIZE, ROUTER_BATCH_SIZE)
+    for index in range(count):
+        router.spawn(index)
+    app = web.Application()
+    app.router.add_post('/', router.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', PORT).start()
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+    forwarders = [asyncio.create_task(router.forward(session, index)) for index in range(count)]
+    watcher = asyncio.create_task(router.watch())
+    logger.info(f"{count} ta ishchi jarayon ishga tushirildi, yangilanishlar foydalanuvchi bo'yicha taqsimlanadi")
+
+    stopped = asyncio.Event()
+    restarts = set()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+
+    def restart() -> None:
+        task = asyncio.create_task(router.restart_all())
+        restarts.add(task)
+        task.add_done_callback(restarts.discard)
+
+    loop.add_signal_handler(signal.SIGHUP, restart)
+    await stopped.wait()
+
+    # To'xtatish: yangi so'rovlar olinmaydi, navbatlar DRAIN_TIMEOUT gacha uzatiladi
+    await runner.cleanup()
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while any(router.queues) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    router.stopping = True
+    for task in [watcher, *forwarders, *restarts]:
+        task.cancel()
+    await asyncio.gather(watcher, *forwarders, *restarts, return_exceptions=True)
+    await session.close()
+    await asyncio.gather(*[router.terminate(index) for index in range(count)])
+    router.save_remaining()
+    logger.info("Barcha ishchi jarayonlar to'xtatildi")
 
 if __name__ == "__main__":
     os.environ['TZ'] = 'UTC'
-    asyncio.run(main())
+    if BOT_WORKERS > 1 and STORAGE_BACKEND != "sqlite":
+        logger.error("BOT_WORKERS > 1 uchun STORAGE_BACKEND=sqlite kerak, bitta jarayonda ishlanadi")
+        BOT_WORKERS = 1
+    if BOT_WORKERS > 1 and "BOT_WORKER_INDEX" not in os.environ:
+        asyncio.run(run_workers(BOT_WORKERS))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# bot.py import qilinganda sozlamalar muhitdan o'qiladi va JSON fayllar joriy
+# papkada yaratiladi, shuning uchun import vaqtinchalik papkada bajariladi.
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_IDS", "1001,1002,1003,1004,1005,1006")
+os.environ.setdefault("WEBHOOK_WORKERS", "8")
+os.environ.setdefault("METRICS_PORT", "0")
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+sys.path.insert(0, BOT_DIR)
+
+import bot  # noqa: E402
+
+# main() dagi kabi ma'lumotlar va indekslar sinovlardan oldin bir marta yuklanadi
+bot.load_data()
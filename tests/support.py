@@ -0,0 +1,63 @@
+import asyncio
+import socket
+
+import bot
+from aiohttp import web
+from benchmark import TOKEN, FakeBotApi
+
+
+# Yuborilgan va tahrirlangan xabarlar matnini chat bo'yicha yozib boradi.
+# blocked dagi chatlarga xabar yuborish 403 bilan rad etiladi.
+class RecordingBotApi(FakeBotApi):
+    def __init__(self, blocked: set = ()):
+        super().__init__(0.0, 0.0, 1)
+        self.blocked = set(blocked)
+        self.texts = {}
+        self.edits = {}
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if method in ("sendMessage", "editMessageText"):
+            data = await request.json() if request.content_type == "application/json" else dict(await request.post())
+            chat_id = int(data["chat_id"])
+            if chat_id in self.blocked:
+                return web.json_response({"ok": False, "error_code": 403,
+                                          "description": "Forbidden: bot was blocked by the user"}, status=403)
+            target = self.texts if method == "sendMessage" else self.edits
+            target.setdefault(chat_id, []).append(data["text"])
+        return await super().handle(request)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_ingress(application, updates: list, workers: int) -> bot.WebhookIngress:
+    ingress = bot.WebhookIngress(len(updates), workers, len(updates))
+    for data in updates:
+        assert ingress.submit(data)
+    await ingress.start(application)
+    await asyncio.wait_for(ingress.queue.join(), 30)
+    await ingress.stop()
+    return ingress
+
+
+# Haqiqiy Application ni soxta Bot API bilan ishga tushirib, yangilanishlarni berilgan
+# tartibda WebhookIngress orqali o'tkazadi
+async def run_bot(updates: list, workers: int = None, after=None, blocked: set = ()) -> RecordingBotApi:
+    api = RecordingBotApi(blocked)
+    base_url = await api.start(free_port())
+    application = bot.build_application(TOKEN, base_url=base_url)
+    await application.initialize()
+    await application.start()
+    try:
+        await run_ingress(application, updates, workers or bot.WEBHOOK_WORKERS)
+        if after is not None:
+            await after()
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+    return api
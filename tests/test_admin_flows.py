@@ -0,0 +1,119 @@
+import asyncio
+
+import bot
+from benchmark import callback_update, message_update
+from support import run_bot
+
+
+def add_serial(number: str) -> None:
+    bot.movies_data[number] = {"title": f"Serial {number}", "part_data": [
+        {"part_name": "1-qism", "part_url": f"https://example.com/{number}/1.mp4"}], "views": 0}
+    bot.catalog_index.add(number, bot.movies_data[number])
+
+
+def admin_action(update_id: int, user_id: int, name: str) -> dict:
+    return callback_update(update_id, user_id, bot.callback_router.encode("a", name))
+
+
+# O'chirish katalogi ochiq qolgan holda yangi qism qo'shish boshlanadi: matnlar
+# o'chirish qidiruviga emas, yangi qism oqimiga tushishi kerak
+def test_abandoned_delete_catalog_does_not_capture_add_part_text():
+    user_id = 1004
+    add_serial("9004")
+    updates = [
+        admin_action(7000, user_id, "delete_movie"),
+        admin_action(7001, user_id, "add_new_part"),
+        callback_update(7002, user_id, bot.callback_router.encode("ap", "9004")),
+        message_update(7003, user_id, "Yangi qism"),
+        message_update(7004, user_id, "https://example.com/9004/2.mp4"),
+    ]
+    api = asyncio.run(run_bot(updates))
+
+    assert bot.movies_data["9004"]["part_data"][-1] == {
+        "part_name": "Yangi qism", "part_url": "https://example.com/9004/2.mp4"}
+    assert api.texts[user_id] == ["Yangi qism URL manzilini kiriting:", "✅ Yangi qism qo‘shildi: Yangi qism"]
+    assert not any("Filtr" in text for text in api.edits[user_id])
+
+
+def test_cancel_ends_catalog_browse():
+    user_id = 1005
+    add_serial("9005")
+    updates = [
+        admin_action(7100, user_id, "delete_movie"),
+        message_update(7101, user_id, "/cancel"),
+        message_update(7102, user_id, "Serial"),
+    ]
+    api = asyncio.run(run_bot(updates))
+
+    assert api.texts[user_id] == ["Bekor qilindi."]
+    assert "9005" in bot.movies_data
+
+
+# Admin paneldan broadcast: matn BroadcastManager orqali barcha faol foydalanuvchilarga
+# yetadi, botni bloklaganlar nofaol deb belgilanadi
+def test_broadcast_from_admin_panel():
+    admin_id = 1006
+    recipients = list(range(50001, 50011))
+    blocked = {50003, 50007}
+    for user_id in recipients:
+        bot.user_registry.add(user_id, f"user{user_id}", "Test", 0)
+
+    async def wait_for_broadcast():
+        for _ in range(200):
+            if not bot.broadcast_manager.jobs and not bot.broadcast_manager._tasks:
+                return
+            await asyncio.sleep(0.05)
+        raise AssertionError("Broadcast tugamadi")
+
+    updates = [
+        admin_action(7200, admin_id, "broadcast"),
+        message_update(7201, admin_id, "Salom hammaga"),
+    ]
+    api = asyncio.run(run_bot(updates, after=wait_for_broadcast, blocked=blocked))
+
+    assert api.texts[admin_id][0] == "Broadcast xabar matnini kiriting:"
+    for user_id in recipients:
+        if user_id in blocked:
+            assert not bot.user_registry.is_active(user_id)
+        else:
+            assert api.texts[user_id] == ["Salom hammaga"]
+    assert api.edits[admin_id][-1].startswith("✅ Broadcast yakunlandi")
+
+
+def test_simple_movie_flow():
+    user_id = 1001
+    updates = [
+        admin_action(7300, user_id, "add_simple_movie"),
+        message_update(7301, user_id, "Oddiy anime"),
+        message_update(7302, user_id, "https://example.com/simple.mp4"),
+        message_update(7303, user_id, "9301"),
+    ]
+    api = asyncio.run(run_bot(updates))
+
+    assert bot.movies_data["9301"]["title"] == "Oddiy anime"
+    assert bot.movies_data["9301"]["video_url"] == "https://example.com/simple.mp4"
+    assert api.texts[user_id][-1] == "✅ Oddiy Anime qo‘shildi: Oddiy anime"
+
+
+# Cheklovdan oldin qo'shilgan, tugmaga sig'maydigan raqam: foydalanuvchiga video
+# klaviaturasiz yuboriladi, admin katalogida esa tanlab bo'lmaydigan qator bo'lib chiqadi
+def test_legacy_long_number_does_not_break_lookup_or_catalog():
+    user_id, admin_id = 60001, 1002
+    number = "7" * 120
+    bot.movies_data[number] = {"title": "Uzun raqamli serial", "part_data": [
+        {"part_name": "1-qism", "part_url": "https://example.com/long/1.mp4"}], "views": 0}
+    bot.catalog_index.add(number, bot.movies_data[number])
+    assert not bot.callback_router.fits_number(number)
+    updates = [
+        message_update(7400, user_id, number),
+        admin_action(7401, admin_id, "delete_movie"),
+        message_update(7402, admin_id, "Uzun raqamli"),
+        message_update(7403, admin_id, "/cancel"),
+    ]
+    api = asyncio.run(run_bot(updates))
+
+    assert api.calls.get("sendVideo") == 1
+    assert api.texts[admin_id][0].startswith("O'chirish uchun animeni tanlang:\nFiltr: «Uzun raqamli»")
+    assert api.texts[admin_id][1] == "Bekor qilindi."
+    del bot.movies_data[number]
+    bot.catalog_index.remove(number)
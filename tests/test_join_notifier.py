@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+import bot
+from telegram.error import RetryAfter
+
+
+# Birinchi `retry_after_calls` ta yuborishga RetryAfter qaytaradi
+class FlakyBot:
+    def __init__(self, retry_after_calls: int, retry_after: float):
+        self.retry_after_calls = retry_after_calls
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.retry_after_calls:
+            self.retry_after_calls -= 1
+            raise RetryAfter(self.retry_after)
+        self.sent.append(text)
+
+
+def paused_notifier(monkeypatch, flaky: FlakyBot) -> bot.JoinNotifier:
+    monkeypatch.setattr(bot, "NOTIFICATION_CHANNEL_ID", "-1001")
+    notifier = bot.JoinNotifier(60, 100, 5)
+    notifier.add("Ali", "ali", "tg://user?id=1")
+    notifier.add("Vali", "vali", "tg://user?id=2")
+    asyncio.run(notifier.flush(flaky))
+    assert not flaky.sent and notifier._count == 2
+    return notifier
+
+
+# To'xtatishdagi yuborish RetryAfter pauzasi tugashini kutadi va yig'ma xabarni yo'qotmaydi
+def test_close_waits_out_retry_after(monkeypatch):
+    flaky = FlakyBot(1, 0.05)
+    notifier = paused_notifier(monkeypatch, flaky)
+    asyncio.run(notifier.close(flaky, timeout=1))
+    assert len(flaky.sent) == 1 and flaky.sent[0].startswith("Yangi foydalanuvchilar: 2 ta")
+
+
+# Pauza to'xtatish muddatidan uzun bo'lsa xabar jimgina yo'qolmaydi, soni log qilinadi
+def test_close_logs_dropped_digest(monkeypatch, caplog):
+    flaky = FlakyBot(1, 30)
+    notifier = paused_notifier(monkeypatch, flaky)
+    with caplog.at_level(logging.WARNING, logger=bot.logger.name):
+        asyncio.run(notifier.close(flaky, timeout=0.1))
+    assert not flaky.sent
+    assert "2 ta foydalanuvchi haqida xabar berilmaydi" in caplog.text
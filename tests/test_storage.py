@@ -0,0 +1,100 @@
+import asyncio
+import json
+from datetime import datetime
+
+import bot
+
+
+# Yozish oqimiga movies_data ning nusxasi beriladi: yozuv navbatda turganda asosiy oqimdagi
+# o'zgarishlar faylga aralashmaydi, keyingi yozuv esa ularni o'z ichiga oladi
+def test_json_storage_writes_snapshot_of_movies():
+    storage = bot.JsonStorage()
+    number = "9401"
+    bot.movies_data[number] = {"title": "Serial 9401", "part_data": [
+        {"part_name": "1-qism", "part_url": "https://example.com/9401/1.mp4"}], "views": 0}
+
+    async def run():
+        write = asyncio.create_task(storage.save_movie(number, bot.movies_data[number]))
+        await asyncio.sleep(0)
+        bot.movies_data[number]["part_data"].append({"part_name": "2-qism", "part_url": "https://example.com/9401/2.mp4"})
+        bot.movies_data[number]["views"] = 7
+        await write
+        with open("movies.json") as f:
+            first = json.load(f)[number]
+        await storage.add_part(number, 1, bot.movies_data[number]["part_data"][1])
+        with open("movies.json") as f:
+            second = json.load(f)[number]
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert len(first["part_data"]) == 1 and first["views"] == 0
+    assert second == bot.movies_data[number]
+    del bot.movies_data[number]
+
+
+def test_user_registry_copy_is_independent():
+    registry = bot.UserRegistry()
+    registry.add(1, "a", "A", 0)
+    snapshot = registry.copy()
+    registry.add(2, "b", "B", 0)
+    registry.set_active(1, False)
+    assert snapshot.to_json() == {"1": {"username": "a", "first_name": "A", "joined_date": None, "active": True}}
+
+
+# A'zolik o'zgarishlari jurnalga qo'shiladi, MEMBERSHIP_COMPACT_RECORDS dan keyin to'liq
+# indeks faylga yoziladi; qayta yuklanganda fayl va jurnal birga o'qiladi
+def test_membership_log_round_trip(monkeypatch):
+    index = bot.MembershipIndex(10, 3600, 5)
+    monkeypatch.setattr(bot, "membership_index", index)
+    monkeypatch.setattr(bot, "MEMBERSHIP_COMPACT_RECORDS", 2)
+    storage = bot.JsonStorage()
+    monkeypatch.setattr(bot, "storage", storage)
+
+    async def run():
+        index.set(1, "@a", True, track=True)
+        index.set(2, "@a", False, track=True)
+        index.set(3, "@b", True, track=True)
+        await index.flush()
+        index.set(2, "@a", True)
+        index.retain(["@a"])
+        await index.flush()
+        index.set(1, "@a", False)
+        await index.flush()
+
+    asyncio.run(run())
+    with open(bot.MEMBERSHIP_FILE) as f:
+        compacted = json.load(f)
+    # Ikkinchi flushdan keyin yozilgan holat, uchinchisi faqat jurnalda
+    assert {channel: [sorted(members), sorted(left)] for channel, (members, left) in compacted.items()} == {
+        "@a": [[1, 2], []]}
+    assert sorted(bot.JsonStorage().load_memberships()) == [("@a", 1, False), ("@a", 2, True)]
+
+
+# Qo'shilgan sana asl siljishi va mikrosekundlari bilan qaytadi; siljishsiz sana
+# mahalliy vaqt deb olinib, mahalliy siljish bilan yoziladi
+def test_joined_date_round_trip():
+    naive = "2023-05-01 10:00:00.123456"
+    dates = {
+        "1": "2024-01-02 03:04:05+00:00",
+        "2": "2024-01-02 03:04:05.654321+00:00",
+        "3": "2024-01-02 08:04:05.000001+05:00",
+        "4": naive,
+        "5": None,
+    }
+    registry = bot.UserRegistry.from_json({user_id: {"joined_date": date} for user_id, date in dates.items()})
+    registry = bot.UserRegistry.from_columns(registry.copy().columns())
+    result = {user_id: user["joined_date"] for user_id, user in registry.to_json().items()}
+    assert result == {**dates, "4": str(datetime.fromisoformat(naive).astimezone())}
+
+
+# Boshqa sahifadagi tanlov uchun alohida klaviatura qurilmaydi
+def test_parts_keyboard_cache_ignores_selection_off_page():
+    number = "9402"
+    bot.movies_data[number] = {"title": "Serial 9402", "part_data": [
+        {"part_name": f"{i}-qism", "part_url": f"https://example.com/9402/{i}.mp4"} for i in range(1, 13)], "views": 0}
+    cache = bot.PartsKeyboardCache(100)
+    page_one = cache.get(number, 1, 0)
+    assert cache.get(number, 1, 3) is page_one and cache.get(number, 1, None) is page_one
+    assert cache.get(number, 1, 6) is not page_one
+    assert len(cache._entries) == 2
+    del bot.movies_data[number]
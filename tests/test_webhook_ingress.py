@@ -0,0 +1,146 @@
+import asyncio
+
+import aiohttp
+import bot
+from aiohttp import web
+from benchmark import callback_update, message_update
+from support import free_port, run_bot, run_ingress
+
+
+# Har bir yangilanish ishlov vaqtini va bir foydalanuvchining parallel ishlanishini yozib
+# boradi. Oldingi yangilanishlar uzoqroq ishlanadi: tartib saqlanmasa natija buziladi.
+class RecordingApplication:
+    bot = None
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.processed = {}
+        self.running = set()
+        self.max_running = 0
+        self.same_user_overlaps = 0
+
+    async def process_update(self, update):
+        user_id = update.effective_user.id
+        if user_id in self.running:
+            self.same_user_overlaps += 1
+        self.running.add(user_id)
+        self.max_running = max(self.max_running, len(self.running))
+        try:
+            await asyncio.sleep(self.delay * (3 - update.update_id % 3))
+        finally:
+            self.running.discard(user_id)
+        self.processed.setdefault(user_id, []).append(update.update_id)
+
+
+# Bir nechta foydalanuvchining yangilanishlari aralash tartibda: har bir foydalanuvchi
+# uchun update_id lar o'sib boradi
+def interleaved_updates(user_ids: list, per_user: int) -> list:
+    updates = []
+    for i in range(per_user):
+        for user_id in user_ids:
+            updates.append(message_update(len(updates) + 1, user_id, f"xabar {i}"))
+    return updates
+
+
+def test_per_user_order_is_preserved():
+    user_ids = [11, 12, 13, 14, 15]
+    updates = interleaved_updates(user_ids, 20)
+    application = RecordingApplication(delay=0.001)
+    asyncio.run(run_ingress(application, updates, workers=4))
+
+    assert application.same_user_overlaps == 0
+    for user_id in user_ids:
+        expected = [data["update_id"] for data in updates if data["message"]["from"]["id"] == user_id]
+        assert application.processed[user_id] == expected
+
+
+def test_different_users_are_processed_concurrently():
+    user_ids = list(range(100, 108))
+    updates = interleaved_updates(user_ids, 5)
+    application = RecordingApplication(delay=0.02)
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        await run_ingress(application, updates, workers=8)
+        return asyncio.get_running_loop().time() - started
+
+    elapsed = asyncio.run(run())
+    assert application.max_running > 1
+    # Ketma-ket ishlanganda 40 ta yangilanish taxminan 40 * 0.04 = 1.6 s olardi
+    assert elapsed < 0.5
+
+
+def test_workers_limit_concurrency():
+    updates = interleaved_updates(list(range(200, 216)), 2)
+    application = RecordingApplication(delay=0.005)
+    asyncio.run(run_ingress(application, updates, workers=3))
+    assert application.max_running <= 3
+
+
+# Haqiqiy Application va ConversationHandler: uch admin bir vaqtda qismli animega yangi
+# qism qo'shadi, yangilanishlari aralash holda navbatga qo'yiladi
+def test_conversation_flow_with_parallel_workers():
+    admins = {1001: "9001", 1002: "9002", 1003: "9003"}
+    for number in admins.values():
+        bot.movies_data[number] = {"title": f"Serial {number}", "part_data": [
+            {"part_name": "1-qism", "part_url": f"https://example.com/{number}/1.mp4"}], "views": 0}
+        bot.catalog_index.add(number, bot.movies_data[number])
+    steps = [
+        lambda user_id, update_id: callback_update(update_id, user_id, bot.callback_router.encode("a", "add_new_part")),
+        lambda user_id, update_id: callback_update(update_id, user_id, bot.callback_router.encode("ap", admins[user_id])),
+        lambda user_id, update_id: message_update(update_id, user_id, f"Qism {user_id}"),
+        lambda user_id, update_id: message_update(update_id, user_id, f"https://example.com/{user_id}.mp4"),
+    ]
+    updates = []
+    for step in steps:
+        for user_id in admins:
+            updates.append(step(user_id, 5000 + len(updates)))
+    assert bot.WEBHOOK_WORKERS > 1
+    api = asyncio.run(run_bot(updates))
+
+    for user_id, number in admins.items():
+        assert bot.movies_data[number]["part_data"][-1] == {
+            "part_name": f"Qism {user_id}", "part_url": f"https://example.com/{user_id}.mp4"}
+        assert api.texts[user_id] == [
+            "Yangi qism URL manzilini kiriting:",
+            f"✅ Yangi qism qo‘shildi: Qism {user_id}",
+        ]
+
+
+# Restartdan keyin: oldingi jarayon saqlagan yangilanishlar fayldan o'qilguncha webhookka
+# kelganlari kutib turadi va ulardan keyin ishlanadi
+def test_handover_replay_precedes_new_updates(monkeypatch):
+    user_id = 21
+    saved = [message_update(update_id, user_id, f"eski {update_id}") for update_id in (1, 2, 3)]
+    fresh = [message_update(update_id, user_id, f"yangi {update_id}") for update_id in (4, 5, 6)]
+    bot.save_json(bot.HANDOVER_FILE, saved)
+    ingress = bot.WebhookIngress(100, 4, 100)
+    monkeypatch.setattr(bot, "webhook_ingress", ingress)
+    monkeypatch.setattr(bot, "pending_replayed", False)
+    application = RecordingApplication(delay=0.001)
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/", bot.webhook_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        await ingress.start(application)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for data in fresh:
+                    async with session.post(f"http://127.0.0.1:{port}/", json=data) as response:
+                        assert response.status == 200
+            await asyncio.sleep(0.05)
+            assert application.processed == {}
+            await bot.replay_pending_updates()
+            await asyncio.wait_for(ingress.queue.join(), 30)
+        finally:
+            await ingress.stop()
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert bot.pending_replayed
+    assert not bot.deferred_updates
+    assert application.processed[user_id] == [1, 2, 3, 4, 5, 6]